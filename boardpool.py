@@ -0,0 +1,190 @@
+#!/usr/bin/python3
+"""
+Board pool module for tetris
+
+Shares the boards of games running in worker processes with a parent
+process through one block of shared memory. Each board gets a fixed
+size slot holding a sequence counter followed by one color byte per
+cell, row by row.
+
+Writers follow the seqlock pattern: the counter is made odd before the
+cells are changed and even again afterwards. Readers copy the cells
+between two reads of the counter and retry if it was odd or changed, so
+they never block a writer and never see half a board. A reader gives
+up after a number of attempts, so a writer that died part way through
+a write can't hang it. Each slot must only have one writer.
+"""
+
+import struct
+from multiprocessing import shared_memory
+
+SEQUENCE = struct.Struct('<Q')
+MAX_ATTEMPTS = 1 << 16 # reads of a busy slot before giving up
+
+class BoardBusyException(Exception):
+    """
+    Exception raised when a slot stays in the middle of a write
+    """
+    def __init__(self, reason):
+        self.reason = reason
+    def __str__(self):
+        return repr(self.reason)
+
+class BoardPool(object):
+    """
+    Block of shared memory holding a number of boards
+    """
+    def __init__(self, slots, width=10, height=20, name=None, create=True):
+        """
+        Creates a new pool, or attaches to an existing one by name
+
+        slots: Number of boards in the pool
+        """
+        self.slots = slots
+        self.width = width
+        self.height = height
+        self.cells = width * height
+        self.slot_size = SEQUENCE.size + self.cells
+        self.memory = shared_memory.SharedMemory(name, create,\
+                                                 slots * self.slot_size)
+        self.buffer = self.memory.buf
+        self.retries = 0 # reads that had to be done again
+    @property
+    def name(self):
+        return self.memory.name
+    def slot(self, index):
+        """
+        Returns the writer for the passed slot
+        """
+        if index < 0 or index >= self.slots:
+            raise IndexError(index)
+        return BoardSlot(self, index)
+    def sequence(self, index):
+        """
+        Returns the sequence counter of a slot. It changes every time the
+        board is written.
+        """
+        return SEQUENCE.unpack_from(self.buffer, index * self.slot_size)[0]
+    def read(self, index, attempts=MAX_ATTEMPTS):
+        """
+        Returns a consistent copy of the cells in the passed slot along
+        with the sequence number they were written under
+
+        attempts: Most times to try before giving up. A slot whose
+          writer died part way through a write stays busy forever.
+
+        Raises BoardBusyException if no consistent copy was read
+        """
+        buf = self.buffer
+        offset = index * self.slot_size
+        start = offset + SEQUENCE.size
+        end = start + self.cells
+        unpack = SEQUENCE.unpack_from
+        for attempt in range(attempts):
+            before = unpack(buf, offset)[0]
+            if before & 1 == 0:
+                cells = bytes(buf[start:end])
+                if unpack(buf, offset)[0] == before:
+                    return (cells, before)
+            self.retries += 1
+        raise BoardBusyException("Slot %i was busy for %i reads" %\
+                                 (index, attempts))
+    def close(self):
+        self.buffer = None
+        self.memory.close()
+    def unlink(self):
+        """
+        Frees the shared memory. Only the creator should do this.
+        """
+        self.memory.unlink()
+
+class BoardSlot(object):
+    """
+    Writer for a single board in a pool
+    """
+    def __init__(self, pool, index):
+        self.pool = pool
+        self.index = index
+        self.offset = index * pool.slot_size
+        self.writes = 0
+    def write(self, cells):
+        """
+        Replaces the board with the passed row by row cell colors
+        """
+        buf = self.pool.buffer
+        start = self.offset + SEQUENCE.size
+        sequence = SEQUENCE.unpack_from(buf, self.offset)[0]
+        SEQUENCE.pack_into(buf, self.offset, sequence + 1)
+        buf[start:start + self.pool.cells] = cells
+        SEQUENCE.pack_into(buf, self.offset, sequence + 2)
+        self.writes += 1
+
+def play(name, slots, index, seconds, block_type):
+    """
+    Plays games with random input as fast as possible, publishing the
+    board into a slot of the pool
+    """
+    import random, time
+    from game import MasterTetris, load_data
+    from rollback import apply_input, LEFT, RIGHT, DOWN, ROTATE_LEFT
+    colordefs, block_types = load_data()
+    pool = BoardPool(slots, name=name, create=False)
+    slot = pool.slot(index)
+    rnd = random.Random(index)
+    masks = [0, 0, 0, LEFT, RIGHT, DOWN, ROTATE_LEFT]
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        game = MasterTetris((0, 0), block_types[block_type],\
+                            rnd.getrandbits(32), board=slot)
+        while time.perf_counter() < end:
+            apply_input(game, rnd.choice(masks))
+            if not game.tick():
+                break
+    pool.close()
+
+def measure(workers=4, seconds=2.0, block_type="Tetrominoes"):
+    """
+    Runs games in worker processes while the parent reads every board
+    as fast as it can
+
+    Returns a dict with the reads per second, the fraction of reads
+    that had to be retried and the boards written per second
+    """
+    import multiprocessing, time
+    pool = BoardPool(workers)
+    processes = [multiprocessing.Process(target=play,\
+                     args=(pool.name, workers, i, seconds, block_type))\
+                 for i in range(workers)]
+    for p in processes:
+        p.start()
+    reads = 0
+    start = time.perf_counter()
+    while any(p.is_alive() for p in processes):
+        for i in range(workers):
+            pool.read(i)
+        reads += workers
+    elapsed = time.perf_counter() - start
+    for p in processes:
+        p.join()
+    writes = sum(pool.sequence(i) // 2 for i in range(workers))
+    result = {
+        "workers": workers,
+        "reads_per_second": reads / elapsed,
+        "retry_rate": pool.retries / max(reads, 1),
+        "writes_per_second": writes / elapsed,
+    }
+    pool.close()
+    pool.unlink()
+    return result
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description=\
+        "Measure reading boards from shared memory while workers write")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--seconds", type=float, default=2.0)
+    args = parser.parse_args()
+    r = measure(args.workers, args.seconds)
+    print("%i workers: %.0f board reads/s, %.0f board writes/s, "\
+          "%.4f%% reads retried" % (r["workers"], r["reads_per_second"],\
+          r["writes_per_second"], r["retry_rate"] * 100))
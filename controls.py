@@ -0,0 +1,108 @@
+"""
+Input module for tetris
+
+Contains classes for reading keys in batches and turning held keys into
+a controlled number of repeated moves
+"""
+
+import datetime
+
+class KeyQueue(object):
+    """
+    Drains every pending key from a curses window each frame
+
+    Consecutive identical keys are collapsed into a single run so that a
+    held key can be acted on once per frame instead of once per repeat.
+    """
+    def __init__(self, window):
+        """
+        Creates a new queue reading from the passed window. The window
+        should be in nodelay mode.
+        """
+        self.window = window
+    def drain(self):
+        """
+        Reads all pending keys and returns a list of (key, count) runs in
+        the order the keys were received
+        """
+        runs = []
+        recvd = self.window.getch()
+        while recvd != -1:
+            if len(runs) > 0 and runs[-1][0] == recvd:
+                runs[-1][1] += 1
+            else:
+                runs.append([recvd, 1])
+            recvd = self.window.getch()
+        return [(k, c) for k, c in runs]
+
+class KeyRepeat(object):
+    """
+    Applies delayed auto shift (DAS) and auto repeat rate (ARR) timing to
+    repeated keys
+
+    Terminals don't report key releases, so held keys are recognized by
+    the cadence of the terminal's own auto repeat: a key that arrives
+    again within the repeat gap is still held. A key that arrives after
+    a longer gap is a press and always moves, whether it was tapped again
+    or the terminal has just started repeating it. Once a key has been
+    down for the DAS delay, held repeats move it once every ARR interval.
+    An ARR of zero moves as far as possible.
+    """
+    INSTANT = 1 << 16 # move count used for an ARR of zero
+    def __init__(self, keys, das=datetime.timedelta(seconds=0.17),\
+                 arr=datetime.timedelta(seconds=0.05),\
+                 repeat=datetime.timedelta(seconds=0.05),\
+                 delay=datetime.timedelta(seconds=0.6)):
+        """
+        Creates a new repeat filter
+
+        keys: Keys which auto repeat. Other keys act once per press.
+        das: Time a key must be down before held repeats move it
+        arr: Time between moves once the key is repeating
+        repeat: Longest gap between the terminal's repeats of a held key
+        delay: Longest time the terminal waits before it starts to
+          repeat a held key. A key that comes back within this time may
+          have been down all along, so it keeps its DAS timing.
+        """
+        self.keys = set(keys)
+        self.das = das
+        self.arr = arr
+        self.repeat = repeat
+        self.delay = delay
+        self.__key = None
+        self.__down = None # when the key was first pressed
+        self.__seen = None # when the key was last received
+        self.__moved = None # when the key last moved
+    def __call__(self, key, count, now):
+        """
+        Returns the number of moves to perform for a run of count
+        identical keys received at the passed time
+        """
+        if key not in self.keys:
+            return count
+        if key != self.__key or now - self.__seen > self.delay:
+            # this is a new press
+            self.__key = key
+            self.__down = now
+            self.__seen = now
+            self.__moved = now
+            return count
+        gap = now - self.__seen
+        self.__seen = now
+        if gap > self.repeat:
+            # pressed again, or the terminal started repeating it
+            self.__moved = now
+            return count
+        start = self.__down + self.das
+        if now < start:
+            return 0
+        if self.arr <= datetime.timedelta():
+            return KeyRepeat.INSTANT
+        if self.__moved < start:
+            # the first move once DAS has passed
+            moves = int((now - start) / self.arr) + 1
+            self.__moved = start + self.arr * (moves - 1)
+        else:
+            moves = int((now - self.__moved) / self.arr)
+            self.__moved += self.arr * moves
+        return moves
@@ -4,6 +4,8 @@ Event module
 Containues classes for managing evenst and such
 """
 
+import weakref
+
 class EventDispatcher(object):
     """
     Event object which operates like C# events
@@ -13,6 +15,10 @@ class EventDispatcher(object):
     "event(*arguments)" calls all of the handlers with the passed
     arguments
     
+    Handlers are called in the order they were added. Bound methods are
+    only weakly referenced, so subscribing does not keep the subscriber
+    alive and its handler is dropped as soon as it is collected.
+    
     Events may be temporarily suppressed by using them in a with
     statement. The context returnd will be this event object.
     """
@@ -20,19 +26,39 @@ class EventDispatcher(object):
         """
         Initializes a new event
         """
-        self.__handlers = []
+        # maps each handler (or a weak reference to it) to whether it
+        # is weak. dicts keep insertion order, so this is an ordered set
+        self.__handlers = {}
         self.__supress_count = 0
+    def __key(self, handler):
+        """
+        Returns the key we store the passed handler under
+        """
+        if hasattr(handler, '__self__') and hasattr(handler, '__func__'):
+            dispatcher = weakref.ref(self)
+            def remove(ref):
+                d = dispatcher()
+                if d is not None:
+                    d.__handlers.pop(ref, None)
+            return weakref.WeakMethod(handler, remove)
+        return handler
     def __call__(self, e):
         if self.__supress_count > 0:
             return
-        for h in self.__handlers:
+        # copy so that handlers may subscribe and unsubscribe
+        for h, weak in tuple(self.__handlers.items()):
+            if weak:
+                h = h()
+                if h is None:
+                    continue
             h(e)
     def __iadd__(self, other):
-        if other not in self.__handlers:
-            self.__handlers.append(other)
+        key = self.__key(other)
+        if key not in self.__handlers:
+            self.__handlers[key] = key is not other
         return self
     def __isub__(self, other):
-        self.__handlers.remove(other)
+        del self.__handlers[self.__key(other)]
         return self
     def __enter__(self):
         self.__supress_count += 1
@@ -2,9 +2,11 @@
 Main game module for tetris
 """
 
-import random, datetime, math, asyncore
+import random, datetime, math
 from events import *
 
+DATA_FILE = 'data.xml' # block shapes and colors
+
 class Movable(EventedObject):
     """
     Object with a moveable event and parentage
@@ -14,27 +16,40 @@ class Movable(EventedObject):
         self: The block object that initiated the event
         current_position: self explanatory
         last_position: position as recorded directly before movement
+    
+    Only the object whose local position changed raises the moved
+    event. Its children are not notified through events; instead their
+    cached absolute positions are marked stale and recomputed the next
+    time they are read.
     """
     def __init__(self, local_position, parent=None):
-        super().__init__(parent)
-        if hasattr(self.parent, 'event'):
-            self.parent.event += self.__on_parent_event
         self.__local_position = local_position
-    def __on_event(self, e):
-        # update parent event handler
-        if e.target is self and e.name == "parent-changing":
-            if hasattr(e.kwargs['current'], 'event'):
-                e.kwargs['current'].event -= self.__on_parent_event
-        if e.target is self and e.name == "parent-changed":
-            if hasattr(e.kwargs['current'], 'event'):
-                e.kwargs['current'].event += self.__on_parent_event
-    def __on_parent_event(self, e):
-        if e.target is self.parent and e.name == "position-changed":
-            # we echo back this event with our new position because
-            # we depend on the parent position
-            l = self.__translate_position(e.kwargs['last'])
-            self.event(Event(self, "position-changed",\
-                             current=self.position, last=l))
+        self.__position = None # cached absolute position
+        self.__children = set()
+        super().__init__(parent)
+    @property
+    def parent(self):
+        return EventedObject.parent.fget(self)
+    @parent.setter
+    def parent(self, value):
+        last = self.parent
+        if isinstance(last, Movable):
+            last.__children.discard(self)
+        EventedObject.parent.fset(self, value)
+        if isinstance(value, Movable):
+            value.__children.add(self)
+        self.invalidate_position()
+    def invalidate_position(self):
+        """
+        Marks the cached position of this object and its children as
+        stale. A stale object never has a child with a valid cache, so
+        we can stop as soon as we find one.
+        """
+        if self.__position is None:
+            return
+        self.__position = None
+        for c in self.__children:
+            c.invalidate_position()
     @property
     def local_position(self):
         return self.__local_position
@@ -42,21 +57,27 @@ class Movable(EventedObject):
     def local_position(self, value):
         l = self.position
         self.__local_position = value
+        self.invalidate_position()
         self.event(Event(self, "position-changed",\
                          current=self.position, last=l))
     @property
     def position(self):
-        origin = (0,0)
-        if hasattr(self.parent, 'position'):
-            origin = self.parent.position
-        return self.__translate_position(origin)
+        position = self.__position
+        if position is None:
+            origin = (0,0)
+            if hasattr(self.parent, 'position'):
+                origin = self.parent.position
+            position = self.__translate_position(origin)
+            self.__position = position
+        return position
         
     def __translate_position(self, origin):
         """
         Returns this block's position translated to an origin
         """
-        return (origin[0] + self.__local_position[0], origin[1] + \
-                self.__local_position[1])
+        local_position = self.local_position
+        return (origin[0] + local_position[0], origin[1] + \
+                local_position[1])
 
 class Block(Movable):
     """
@@ -67,8 +88,8 @@ class Block(Movable):
         Initializes the block
         
         parent: Object with a position property used as an origin.
-          If none, (0,0) is used. If the parent has a moved event, it
-          will be subscribed to
+          If none, (0,0) is used. The absolute position is cached and
+          only worked out again after the parent moves
         lx: x position relative to parent
         ly: y position relative to parent
         color: color number to use
@@ -131,6 +152,29 @@ class Polyomino(Movable):
             p[2].local_position = (p[0], p[1])
         self.event(Event(self, "rotated"))
         return True
+    def slide(self, delta, count):
+        """
+        Attempts to move this polyomino by delta up to count times,
+        stopping short of the first collision. The polyomino is moved
+        once to its final position.
+        
+        Returns the number of steps actually moved
+        """
+        dx = delta[0]
+        dy = delta[1]
+        blocks = [b.local_position for b in self.blocks]
+        steps = 0
+        while steps < count:
+            tx = dx * (steps + 1)
+            ty = dy * (steps + 1)
+            if not self.__check_locations([(x + tx, y + ty)\
+                                           for x, y in blocks]):
+                break
+            steps += 1
+        if steps > 0:
+            self.local_position = (self.local_position[0] + dx * steps,\
+                                   self.local_position[1] + dy * steps)
+        return steps
     def move_delta(self, delta):
         """
         Attempts to move this polyomino to the passed position
@@ -144,27 +188,27 @@ class Polyomino(Movable):
             new_local_positions.append((x + dx, y + dy, b))
         if not self.__check_locations(new_local_positions):
             return False
-        l = self.position
-        # update our position, no need to opdate our children's position
+        # update our position, no need to update our children's position
+        # since they are relative to us. This raises the moved event.
         self.local_position = (self.local_position[0] + dx,\
                                self.local_position[1] + dy)
-        self.event(Event(self, "position-changed",\
-                         current=self.position, last=l))
         return True
         
 class PolyominoFactory(object):
     """
     Factory callable class for polyominos
     """
-    def __init__(self, blocktuples, color):
+    def __init__(self, blocktuples, color, name=None):
         """
         Creates a new factory
         
         blocktupes: Set of tuples of (x,y) for each block location
         color: Color number to use for this polyomino
+        name: Name of this polyomino, if any
         """
         self.tuples = blocktuples
         self.color = color
+        self.name = name
     def __call__(self, grid, position):
         """
         Creates a polyomino at the passed location
@@ -175,19 +219,76 @@ class PolyominoFactory(object):
                                           parent=polyomino))
         return polyomino
 
+class Row(Movable):
+    """
+    Row of blocks in a grid
+
+    Blocks in a row are positioned relative to it. A row doesn't store
+    its own position; it is worked out from the row's slot in the
+    grid's ring of rows, so rows are moved by changing slots.
+    """
+    def __init__(self, width, slot, parent=None):
+        self.slot = slot
+        self.cells = [None] * width
+        self.count = 0 # number of blocks in this row
+        super().__init__((0, 0), parent)
+    @property
+    def local_position(self):
+        return (0, self.parent.row_index(self))
+    def clear(self):
+        """
+        Empties this row, returning the blocks that were in it
+        """
+        removed = [b for b in self.cells if b is not None]
+        self.cells = [None] * len(self.cells)
+        self.count = 0
+        return removed
+
 class Grid(Movable):
     """
     Represents a game grid
+
+    Rows are kept in a ring buffer. Row y is stored in slot
+    (top + y) % height, so pushing rows in from the bottom only moves
+    the top of the ring and collapsing cleared rows only moves rows
+    between slots. Blocks never have to be moved one at a time.
     """
-    def __init__(self, position=(0,0), width=10, height=20,parent=None):
+    GARBAGE_COLOR = 5
+    def __init__(self, position=(0,0), width=10, height=20,parent=None,\
+                 board=None):
+        """
+        board: Optional BoardSlot from a shared BoardPool. If given, the
+          grid's cells are written to it every time they change.
+        """
+        if board is not None and (board.pool.width != width or\
+                                  board.pool.height != height):
+            raise ValueError("Board slot is %ix%i but the grid is %ix%i" %\
+                             (board.pool.width, board.pool.height, width,\
+                              height))
         super().__init__(position, parent)
         self.width = width
         self.height = height
-        self.grid = []
-        for x in range(width):
-            self.grid.append([])
-            for y in range(height):
-                self.grid[x].append(None)
+        self.board = board
+        self.top = 0 # slot of the top row
+        self.rows = []
+        for slot in range(height):
+            self.rows.append(Row(width, slot, parent=self))
+        self.__publish() # the slot may still hold another game's board
+    def row(self, y):
+        """
+        Returns the row at the passed relative y position
+        """
+        return self.rows[(self.top + y) % self.height]
+    def row_index(self, row):
+        """
+        Returns the relative y position of the passed row
+        """
+        return (row.slot - self.top) % self.height
+    def block_at(self, position):
+        """
+        Returns the block at the passed relative position, if any
+        """
+        return self.row(position[1]).cells[position[0]]
     def is_clear(self, position):
         """
         Returns true if the passed relative position is clear on the
@@ -195,76 +296,190 @@ class Grid(Movable):
         """
         x = position[0]
         y = position[1]
-        if y < 0:
-            return True # we have no bound on the upper side
         if x < 0 or x >= self.width or y >= self.height:
             return False
-        return True if self.grid[x][y] is None else False
+        if y < 0:
+            return True # we have no bound on the upper side
+        return True if self.row(y).cells[x] is None else False
     def add_polyomino(self, polyomino):
         """
         Adds the passed block to this grid. This modifies the blocks
         in the passed polyomino to be relative to the grid. If the
         polyomino's parent is this grid, it no longer has a parent
+
+        Returns false without adding anything if any block is outside
+        the grid or on top of another block, such as a piece locking
+        above the top row
         """
+        origin = self.position if polyomino.parent is self else (0, 0)
+        for b in polyomino.blocks:
+            p = (b.position[0] - origin[0], b.position[1] - origin[1])
+            if p[1] < 0 or not self.is_clear(p):
+                return False
         # we want the block positions relative to the polyomino, not
         # relative to the parent of the polyomino (us).
         if polyomino.parent is self:
             polyomino.parent = None # should make the origin (0,0)
         for b in polyomino.blocks:
-            # we can suppress the move event here since we are simply
-            # removing a level of parentage
-            lp = b.local_position
             p = b.position
+            row = self.row(p[1])
+            # we can suppress the move event here since we are simply
+            # changing the level of parentage
             with b.event: # suppress events from the block
-                b.local_position = b.position # as we change position
                 b.parent = None
-            self.grid[b.position[0]][b.position[1]] = b
-            b.parent = self # the block is relative to us now
+                b.local_position = (p[0], 0) # as we change position
+            row.cells[p[0]] = b
+            row.count += 1
+            b.parent = row # the block is relative to its row now
             self.event(Event(self, "block-added", block=b))
+        self.__publish()
+        return True
+    def __move_rows(self, first, rows):
+        """
+        Stores the passed rows in order starting at relative position
+        first, invalidating the positions of any that moved
+        """
+        for i in range(len(rows)):
+            slot = (self.top + first + i) % self.height
+            if rows[i].slot != slot:
+                rows[i].slot = slot
+                rows[i].invalidate_position()
+            self.rows[slot] = rows[i]
     def clear_rows(self):
         removed = []
+        cleared = []
+        last = -1 # lowest cleared row
         for y in range(self.height):
-            row = True
-            for x in range(self.width):
-                if self.grid[x][y] is None:
-                    row = False
-                    break
-            if row:
-                # move the blocks above this one down one row
-                # we can do this since we proceed from row 0 upwards
-                for x in range(self.width):
-                    removed.append(self.grid[x][y])
-                for y_p in range(y, 0, -1):
-                    for x in range(self.width):
-                        self.grid[x][y_p] = self.grid[x][y_p-1]
-                        if self.grid[x][y_p] is not None:
-                            lpos = self.grid[x][y_p].local_position
-                            self.grid[x][y_p].local_position =\
-                                (lpos[0], lpos[1]+1)
-                for x in range(self.width):
-                    self.grid[x][0] = None
+            row = self.row(y)
+            if row.count == self.width:
+                removed.extend(row.clear())
+                cleared.append(row)
+                last = y
         for r in removed:
             self.event(Event(self, "block-removed", block=r))
+        for r in removed:
+            # the block is no longer part of the grid, so it shouldn't
+            # hang around as one of its row's children
+            with r.event:
+                r.parent = None
+        if last >= 0:
+            # the cleared rows go to the top and the rows above the
+            # lowest one move down. Rows below it stay where they are.
+            above = [self.row(y) for y in range(last + 1)]
+            kept = [r for r in above if r not in cleared]
+            self.__move_rows(0, cleared + kept)
+            self.__publish()
+            self.event(Event(self, "rows-changed"))
         return removed
+    def __publish(self):
+        if self.board is not None:
+            self.board.write(self.save_cells())
+    def save_cells(self):
+        """
+        Returns the color of every cell, row by row, as bytes. Empty
+        cells are 0.
+        """
+        cells = bytearray(self.width * self.height)
+        for y in range(self.height):
+            row = self.row(y)
+            if row.count == 0:
+                continue
+            for x in range(self.width):
+                if row.cells[x] is not None:
+                    cells[y * self.width + x] = row.cells[x].color
+        return bytes(cells)
+    def load_cells(self, cells):
+        """
+        Replaces the blocks in this grid with the colors from save_cells.
+        Only rows that differ are rebuilt.
+        """
+        removed = []
+        with self.event: # the rows-changed event covers all of this
+            for y in range(self.height):
+                row = self.row(y)
+                colors = cells[y * self.width:(y + 1) * self.width]
+                if bytes(0 if b is None else b.color\
+                         for b in row.cells) == colors:
+                    continue
+                removed.extend(row.clear())
+                for x in range(self.width):
+                    if colors[x]:
+                        row.cells[x] = Block((x, 0), colors[x], parent=row)
+                        row.count += 1
+            for r in removed:
+                with r.event:
+                    r.parent = None
+        self.__publish()
+        self.event(Event(self, "rows-changed"))
+    def insert_garbage(self, count=1, hole=0, color=GARBAGE_COLOR):
+        """
+        Pushes count rows of garbage in from the bottom of the grid,
+        moving everything else up. Each garbage row is full except for
+        the hole column.
+
+        Returns false without changing anything if the rows would push
+        blocks off the top of the grid
+        """
+        if count < 0:
+            raise ValueError("Garbage row count is negative: %i" % count)
+        if hole < 0 or hole >= self.width:
+            raise ValueError("Garbage hole %i is outside the grid" % hole)
+        if count > self.height:
+            return False
+        for y in range(count):
+            if self.row(y).count > 0:
+                return False
+        for i in range(count):
+            # the empty top row wraps around to become the bottom row
+            row = self.row(0)
+            self.top = (self.top + 1) % self.height
+            for x in range(self.width):
+                if x != hole:
+                    row.cells[x] = Block((x, 0), color, parent=row)
+                    row.count += 1
+        # every row is now one higher
+        for row in self.rows:
+            row.invalidate_position()
+        for i in range(count):
+            for b in self.row(self.height - 1 - i).cells:
+                if b is not None:
+                    self.event(Event(self, "block-added", block=b))
+        self.__publish()
+        self.event(Event(self, "rows-changed"))
+        return True
 
 class MasterTetris(EventedObject):
     """
     Tetris game
     """
-    def __init__(self, position, block_factories):
+    FPS = 60 # frames per second when stepped with tick
+    def __init__(self, position, block_factories, seed=None, board=None):
         """
         Initializes this tetris game with the passed block_types.
+        
+        seed: Seed for the piece sequence. Games with the same seed and
+          input get the same pieces.
+        board: Optional BoardSlot the grid is published to
         """
         super().__init__()
-        self.grid = Grid(position, parent=self)
+        self.seed = seed
+        self.random = random.Random(seed)
+        self.__random_state = self.random.getstate()
+        self.grid = Grid(position, parent=self, board=board)
         self.__current_piece = None
+        self.__piece_index = None
         self.delta = datetime.timedelta()
+        self.frames = 0 # frames since the piece last fell
         self.__score = 0
         self.__level = 1
         self.__lines = 0
         self.possible_blocks = block_factories
     def __get_new_block(self, position):
-        n = random.randrange(0, len(self.possible_blocks))
+        n = self.random.randrange(0, len(self.possible_blocks))
+        # remember the generator state so snapshots can share it until
+        # the next piece is drawn
+        self.__random_state = self.random.getstate()
+        self.__piece_index = n
         return self.possible_blocks[n](self.grid, position)
     @property
     def current_piece(self):
@@ -299,29 +514,108 @@ class MasterTetris(EventedObject):
         self.__lines = value
         self.event(Event(self, "lines-changed",\
                 lines=self.lines))
+    def __fall(self):
+        """
+        Moves the piece down one row, locking it and starting a new one
+        if it can't move
+        """
+        new_piece = False
+        if self.current_piece == None:
+            new_piece = True
+            self.current_piece = \
+                self.__get_new_block((int(self.grid.width / 2), 0))
+        # attempt to move the piece down
+        if not self.down():
+            if new_piece:
+                return False # the game is done
+            if not self.grid.add_polyomino(self.current_piece):
+                return False # locked above the top, so the game is done
+            # check for rows
+            self.current_piece = None
+            cleared = self.grid.clear_rows()
+            self.lines += int(len(cleared) / self.grid.width)
+            self.score += int(len(cleared) * (len(cleared) /\
+                                                  self.grid.width))
+            self.level = int(math.floor(self.lines / 10)) + 1
+        return True # continue the game
     def step(self, delta):
         self.delta += delta
         min_delta = datetime.timedelta(seconds=0.5 / self.level)
         if self.delta >= min_delta:
             self.delta = datetime.timedelta()
-            new_piece = False
-            if self.current_piece == None:
-                new_piece = True
-                self.current_piece = \
-                    self.__get_new_block((int(self.grid.width / 2), 0))
-            # attempt to move the piece down
-            if not self.down():
-                if new_piece:
-                    return False # the game is done
-                # check for rows
-                self.grid.add_polyomino(self.current_piece)
-                self.current_piece = None
-                cleared = self.grid.clear_rows()
-                self.lines += int(len(cleared) / self.grid.width)
-                self.score += int(len(cleared) * (len(cleared) /\
-                                                      self.grid.width))
-                self.level = int(math.floor(self.lines / 10)) + 1
+            return self.__fall()
+        return True # continue the game
+    def tick(self):
+        """
+        Advances the game by one frame of 1/FPS seconds. Unlike step,
+        this doesn't depend on the clock, so the same seed and inputs
+        always give the same game.
+        """
+        self.frames += 1
+        if self.frames >= max(1, int(MasterTetris.FPS * 0.5 / self.level)):
+            self.frames = 0
+            return self.__fall()
         return True # continue the game
+    def save_state(self):
+        """
+        Returns a compact snapshot of this game which load_state can
+        return it to
+        """
+        piece = None
+        if self.current_piece is not None:
+            piece = (self.__piece_index, self.current_piece.local_position,\
+                     tuple(b.local_position\
+                           for b in self.current_piece.blocks))
+        return (self.grid.save_cells(), piece, self.__score, self.__lines,\
+                self.__level, self.frames, self.delta, self.__random_state)
+    def load_state(self, state):
+        """
+        Returns this game to a snapshot taken by save_state
+        """
+        cells, piece, score, lines, level, frames, delta, random_state =\
+            state
+        self.grid.load_cells(cells)
+        if self.current_piece is not None:
+            with self.current_piece.event:
+                self.current_piece.parent = None
+        if piece is None:
+            self.__current_piece = None
+        else:
+            self.__piece_index = piece[0]
+            p = self.possible_blocks[piece[0]](self.grid, piece[1])
+            for b, local_position in zip(p.blocks, piece[2]):
+                with b.event:
+                    b.local_position = local_position
+            self.__current_piece = p
+        self.__score = score
+        self.__lines = lines
+        self.__level = level
+        self.frames = frames
+        self.delta = delta
+        self.random.setstate(random_state)
+        self.__random_state = random_state
+        self.event(Event(self, "state-loaded"))
+    def add_garbage(self, count, hole):
+        """
+        Pushes garbage rows into the bottom of our grid. The falling
+        piece is pushed up with the blocks if they would overlap it. A
+        piece pushed above the top row tops out when it locks unless it
+        gets back into the grid first.
+        
+        Returns false if the garbage would push blocks off the top
+        """
+        if not self.grid.insert_garbage(count, hole):
+            return False
+        piece = self.current_piece
+        if piece is not None:
+            origin = piece.local_position
+            for b in piece.blocks:
+                if not self.grid.is_clear((origin[0] +\
+                        b.local_position[0], origin[1] +\
+                        b.local_position[1])):
+                    piece.local_position = (origin[0], origin[1] - count)
+                    break
+        return True
     def rotate_left(self):
         if self.current_piece is not None:
             if self.current_piece.rotate_left():
@@ -334,64 +628,53 @@ class MasterTetris(EventedObject):
                 self.event(Event(self, "piece-rotated-right"))
                 return True
         return False
-    def left(self):
+    def __shift(self, delta, count):
         if self.current_piece is not None:
-            if self.current_piece.move_delta((-1, 0)):
-                self.event(Event(self, "piece-moved"))
-                return True
-        return False
-    def right(self):
-        if self.current_piece is not None:
-            if self.current_piece.move_delta((1, 0)):
-                self.event(Event(self, "piece-moved"))
-                return True
-        return False
-    def down(self):
-        if self.current_piece is not None:
-            if self.current_piece.move_delta((0, 1)):
+            if self.current_piece.slide(delta, count) > 0:
                 self.event(Event(self, "piece-moved"))
                 return True
         return False
+    def left(self, count=1):
+        return self.__shift((-1, 0), count)
+    def right(self, count=1):
+        return self.__shift((1, 0), count)
+    def down(self, count=1):
+        return self.__shift((0, 1), count)
 
-class SlaveTetris(EventedObject):
+class SlaveTetris(MasterTetris):
     """
-    Game that follows another. When this object is called, it processes
-    an event as if it were a tetris game
+    Game that follows another player's. It runs the same rules with the
+    other player's seed, but is only driven by their inputs as they
+    arrive over the network. Until then its moves are predicted and
+    corrected by rolling back.
     """
     pass
 
-class NetworkTetrisHost(asyncore.dispatcher):
+def load_data(filename=DATA_FILE):
     """
-    Host end of a multiplayer tetris game
-    
-    Before the game is marked as started, any number of clients can
-    connect. After tha game begins, new connections will be closed after
-    giving them a message of some sort.
-    
-    Events are set along the socket. Each block is tracked by using its
-    id number, which is unique per game-instance (of which there are
-    many)
-    
-    The host serves as a repeater for each client, so that each client
-    sees the events that happen on every other client including the
-    host.
-    
-    It may be possible to do a headless host that just forwards packets
-    around.
-    
-    When everyone's game has ended, the winner is announced.
+    Loads the color definitions and block types from the passed data
+    file
     
-    The host gives each player an identifier. When a client joins, it
-    is informed of all the other identifers and the names attached to
-    them.
+    Returns a tuple of (colordefs, block_types). colordefs maps color
+    ids to (fg, bg) color names. block_types maps type names to lists
+    of polyomino factories.
     """
-    def __init__(self, host, port, username):
-        """
-        Initializes the host game
-        """
-        pass
-
-class NetworkTetrisClient(object):
-    """
-    """
-    pass
+    import xml.etree.ElementTree as ET
+    colordefs = {}
+    block_types = {}
+    tree = ET.parse(filename)
+    root = tree.getroot()
+    if root is not None:
+        for color in root.findall('color'):
+            colordefs[color.get('id')] = (color.get('fg'), color.get('bg'))
+        for t in root.findall('type'):
+            polyominoes = []
+            for p in t.findall('polyomino'):
+                blocktuples = []
+                for b in p.findall('block'):
+                    blocktuples.append((int(b.get('x')), \
+                                        int(b.get('y'))))
+                polyominoes.append(PolyominoFactory(blocktuples,\
+                                   int(p.get('color')), p.get('name')))
+            block_types[t.get('name')] = polyominoes
+    return (colordefs, block_types)
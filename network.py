@@ -0,0 +1,43 @@
+"""
+Network module for tetris
+
+Contains the classes for multiplayer games over the network. These are
+kept out of the game module so that a single player game never has to
+import any networking.
+"""
+
+class NetworkTetrisHost(object):
+    """
+    Host end of a multiplayer tetris game
+    
+    Before the game is marked as started, any number of clients can
+    connect. After tha game begins, new connections will be closed after
+    giving them a message of some sort.
+    
+    Events are set along the socket. Each block is tracked by using its
+    id number, which is unique per game-instance (of which there are
+    many)
+    
+    The host serves as a repeater for each client, so that each client
+    sees the events that happen on every other client including the
+    host.
+    
+    It may be possible to do a headless host that just forwards packets
+    around.
+    
+    When everyone's game has ended, the winner is announced.
+    
+    The host gives each player an identifier. When a client joins, it
+    is informed of all the other identifers and the names attached to
+    them.
+    """
+    def __init__(self, host, port, username):
+        """
+        Initializes the host game
+        """
+        pass
+
+class NetworkTetrisClient(object):
+    """
+    """
+    pass
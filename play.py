@@ -0,0 +1,174 @@
+"""
+Playing states module for tetris
+
+Holds the states which are only needed once a game is started. They are
+kept apart from the menu states so that starting up doesn't have to load
+them or the game module.
+"""
+
+import curses
+import datetime, math
+
+from states import State
+from controls import KeyRepeat
+from game import MasterTetris
+
+class HighScoresState(State):
+    """
+    State for viewing the high scores
+    """
+    def init(self, manager):
+        self.manager = manager
+    def enter(self):
+        pass
+    def exit(self):
+        pass
+    def input(self, char, count=1):
+        pass
+    def render(self, window, delta, terminal_size=None):
+        self.manager.pop_state()
+
+class GameState(State):
+    """
+    State for playing a game
+    """
+    DAS = datetime.timedelta(seconds=0.17)
+    ARR = datetime.timedelta(seconds=0.05)
+    SOFT_DROP = datetime.timedelta(seconds=0.03) # ARR of the down key
+    def __init__(self, blocks, das=DAS, arr=ARR, soft_drop=SOFT_DROP):
+        """
+        blocks: Polyomino factories to play with
+        das: Time left or right must be held before the piece shifts
+        arr: Time between shifts while left or right is held
+        soft_drop: Time between moves while down is held. Soft drop has
+          no DAS delay.
+        """
+        self.last_size = None
+        self.game = MasterTetris((35, 1), blocks)
+        self.game.event += self.__on_game_event
+        self.to_erase = {}
+        self.to_draw = {}
+        self.redraw = False
+        self.clock = datetime.timedelta() # time spent playing
+        self.shift = KeyRepeat([curses.KEY_LEFT, curses.KEY_RIGHT],\
+                               das, arr)
+        self.drop = KeyRepeat([curses.KEY_DOWN], datetime.timedelta(),\
+                              soft_drop)
+    def __on_game_event(self, e):
+        if e.name == 'position-changed' and hasattr(e.target, 'render'):
+            self.__track(e.target, e.kwargs['current'], e.kwargs['last'])
+        elif e.name == 'position-changed' and hasattr(e.target, 'blocks'):
+            # blocks don't echo their parent's movement, so we translate
+            # each block back by the distance the polyomino moved
+            dx = e.kwargs['current'][0] - e.kwargs['last'][0]
+            dy = e.kwargs['current'][1] - e.kwargs['last'][1]
+            for b in e.target.blocks:
+                p = b.position
+                self.__track(b, p, (p[0] - dx, p[1] - dy))
+        if e.name == "rows-changed" or e.name == "state-loaded":
+            # whole rows moved, so the board is redrawn
+            self.redraw = True
+        if e.name == "block-removed":
+            # we need to erase at this block's position
+            if id(e.kwargs['block']) not in self.to_erase:
+                self.to_erase[id(e.kwargs['block'])] =\
+                    e.kwargs['block'].position
+    def __track(self, block, current, last):
+        """
+        Records that a block moved so that it is redrawn next frame
+        """
+        if last[1] < 1 or current[1] < 1:
+            return
+        if id(block) not in self.to_erase:
+            self.to_erase[id(block)] = last
+        self.to_draw[id(block)] = current + (block.render[0],)
+    def init(self, manager):
+        self.manager = manager
+    def enter(self):
+        self.redraw = True
+        self.to_erase.clear()
+        self.to_draw.clear()
+    def exit(self):
+        pass
+    def input(self, char, count=1):
+        if char == 27:
+            self.manager.pop_state()
+        elif char == curses.KEY_UP:
+            for i in range(count):
+                self.game.rotate_left()
+        elif char == curses.KEY_LEFT:
+            self.game.left(self.shift(char, count, self.clock))
+        elif char == curses.KEY_RIGHT:
+            self.game.right(self.shift(char, count, self.clock))
+        elif char == curses.KEY_DOWN:
+            self.game.down(self.drop(char, count, self.clock))
+        elif char == 32:
+            self.manager.push_state(PausedState())
+    def render(self, window, delta, terminal_size=None):
+        self.clock += delta
+        if not self.game.step(delta):
+            self.manager.pop_state()
+            return
+        if self.redraw:
+            window.clear()
+            window.border()
+            window.hline(21, 34, '-', 12)
+            window.vline(1, 34, '|', 20)
+            window.vline(1, 45, '|', 20)
+            if self.game.current_piece is not None:
+                for b in self.game.current_piece.blocks:
+                    window.cell(b.position[1], b.position[0], '#',\
+                                b.color)
+            for y in range(self.game.grid.height):
+                for b in self.game.grid.row(y).cells:
+                    if b is not None:
+                        window.cell(b.position[1], b.position[0], '#',\
+                                    b.render[0])
+            self.to_erase.clear()
+            self.to_draw.clear()
+            self.redraw = False
+        else:
+            if len(self.to_erase) == 0 or len(self.to_draw) == 0:
+                return
+            for v in self.to_erase:
+                pos = self.to_erase[v]
+                window.cell(pos[1], pos[0], ' ')
+            for v in self.to_draw:
+                pos = self.to_draw[v]
+                window.cell(pos[1], pos[0], '#', pos[2])
+            self.to_erase.clear()
+            self.to_draw.clear()
+        window.text(10, 50, "Score: %i      " % self.game.score)
+        window.text(11, 50, "Lines: %i      " % self.game.lines)
+        window.text(12, 50, "Level: %i      " % self.game.level)
+
+class PausedState(State):
+    """
+    State during which the game is paused. This only overwrites a
+    small portion of the screen
+    """
+    def init(self, manager):
+        self.manager = manager
+        self.changed = False
+    def enter(self):
+        self.changed = True
+    def exit(self):
+        pass
+    def input(self, char, count=1):
+        self.manager.pop_state() # any input makes us leave
+    def render(self, window, delta, terminal_size=None):
+        if not self.changed:
+            return
+        t = "Paused"
+        p = "Press any key to unpause"
+        rb = 0 #row base
+        if terminal_size is not None:
+            rb = int(math.ceil(terminal_size.lines / 2)) - 1
+        window.text(rb, self.__get_column(terminal_size, t), t, True)
+        window.text(rb + 1, self.__get_column(terminal_size, p), p, True)
+        self.changed = False
+    def __get_column(self, terminal_size, phrase):
+        if terminal_size == None:
+            return 0
+        else:
+            return int(terminal_size.columns / 2) - int(len(phrase) / 2)
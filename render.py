@@ -0,0 +1,267 @@
+#!/usr/bin/python3
+"""
+Render module for tetris
+
+Contains the backends that states draw onto. States only ever talk to a
+backend, so the same drawing code can go to curses, to a buffered ANSI
+terminal or nowhere at all.
+"""
+
+import os
+from abc import ABCMeta, abstractmethod
+
+COLORS = [ "black", "red", "green", "yellow", "blue", "magenta", "cyan",\
+           "white" ]
+
+class Backend(metaclass=ABCMeta):
+    """
+    Base class for a render backend
+
+    Positions are given as (y, x) like curses. Colors are the color ids
+    from data.xml, with 0 meaning the terminal's default colors.
+    """
+    @abstractmethod
+    def init_colors(self, colordefs):
+        """
+        Sets up the passed color definitions, mapping color ids to
+        (fg, bg) color names
+        """
+        pass
+    @abstractmethod
+    def clear(self):
+        pass
+    @abstractmethod
+    def border(self):
+        pass
+    @abstractmethod
+    def hline(self, y, x, ch, n):
+        pass
+    @abstractmethod
+    def vline(self, y, x, ch, n):
+        pass
+    @abstractmethod
+    def text(self, y, x, s, standout=False):
+        """
+        Draws a string, optionally highlighted
+        """
+        pass
+    @abstractmethod
+    def cell(self, y, x, ch, color=0):
+        """
+        Draws a single character in the passed color
+        """
+        pass
+    @abstractmethod
+    def flush(self):
+        """
+        Finishes a frame, putting everything drawn onto the screen
+        """
+        pass
+
+class CursesBackend(Backend):
+    """
+    Backend which draws onto a curses window
+    """
+    def __init__(self, window):
+        import curses
+        self.window = window
+        self.__standout = curses.A_STANDOUT
+        self.__pairs = {0: 0} # color id to curses attribute
+    def init_colors(self, colordefs):
+        import curses
+        for i in colordefs:
+            color = colordefs[i]
+            curses.init_pair(int(i), get_curses_color(color[0]),\
+                             get_curses_color(color[1]))
+            self.__pairs[int(i)] = curses.color_pair(int(i))
+    def clear(self):
+        self.window.clear()
+    def border(self):
+        self.window.border()
+    def hline(self, y, x, ch, n):
+        self.window.hline(y, x, ord(ch), n)
+    def vline(self, y, x, ch, n):
+        self.window.vline(y, x, ord(ch), n)
+    def text(self, y, x, s, standout=False):
+        if standout:
+            self.window.addstr(y, x, s, self.__standout)
+        else:
+            self.window.addstr(y, x, s)
+    def cell(self, y, x, ch, color=0):
+        self.window.addch(y, x, ord(ch), self.__pairs.get(color, 0))
+    def flush(self):
+        self.window.refresh()
+
+class AnsiBackend(Backend):
+    """
+    Backend which writes ANSI escape sequences to a file descriptor
+
+    Everything drawn during a frame is appended to one buffer which is
+    written with a single os.write when the frame is flushed. Cursor
+    moves and color changes are skipped when the cursor is already in
+    place or the color is already set.
+    """
+    RESET = b'\x1b[0m'
+    STANDOUT = b'\x1b[0;7m'
+    def __init__(self, fd=1, size=None):
+        """
+        Creates a backend writing to the passed file descriptor
+
+        size: Terminal size used for the border. If none, it is read
+          from the file descriptor when needed.
+        """
+        self.fd = fd
+        self.size = size
+        self.writes = 0 # syscalls made
+        self.bytes = 0 # bytes written
+        self.__colors = {0: AnsiBackend.RESET}
+        self.__buffer = bytearray(b'\x1b[?25l') # hide the cursor
+        self.__cursor = None
+        self.__attr = None
+    def init_colors(self, colordefs):
+        for i in colordefs:
+            color = colordefs[i]
+            self.__colors[int(i)] = ('\x1b[0;%i;%im' %\
+                (30 + COLORS.index(color[0]), 40 + COLORS.index(color[1])))\
+                .encode()
+    def __move(self, y, x):
+        if self.__cursor != (y, x):
+            self.__buffer += b'\x1b[%i;%iH' % (y + 1, x + 1)
+    def __set(self, attr):
+        if self.__attr is not attr:
+            self.__buffer += attr
+            self.__attr = attr
+    def __put(self, y, x, s, attr):
+        self.__move(y, x)
+        self.__set(attr)
+        self.__buffer += s.encode()
+        self.__cursor = (y, x + len(s))
+    def clear(self):
+        self.__buffer += b'\x1b[0m\x1b[2J'
+        self.__cursor = None
+        self.__attr = AnsiBackend.RESET
+    def border(self):
+        size = self.size
+        if size is None:
+            try:
+                size = os.get_terminal_size(self.fd)
+            except OSError:
+                size = os.terminal_size((80, 24))
+        self.hline(0, 0, '-', size.columns)
+        self.hline(size.lines - 1, 0, '-', size.columns)
+        self.vline(1, 0, '|', size.lines - 2)
+        self.vline(1, size.columns - 1, '|', size.lines - 2)
+    def hline(self, y, x, ch, n):
+        self.__put(y, x, ch * n, AnsiBackend.RESET)
+    def vline(self, y, x, ch, n):
+        for i in range(n):
+            self.__put(y + i, x, ch, AnsiBackend.RESET)
+    def text(self, y, x, s, standout=False):
+        self.__put(y, x, s, AnsiBackend.STANDOUT if standout else\
+                   AnsiBackend.RESET)
+    def cell(self, y, x, ch, color=0):
+        self.__put(y, x, ch, self.__colors.get(color, AnsiBackend.RESET))
+    def flush(self):
+        if len(self.__buffer) == 0:
+            return
+        data = memoryview(self.__buffer)
+        while len(data) > 0:
+            n = os.write(self.fd, data)
+            self.writes += 1
+            self.bytes += n
+            data = data[n:]
+        self.__buffer = bytearray()
+    def close(self):
+        """
+        Restores the terminal's colors and cursor
+        """
+        self.__buffer += b'\x1b[0m\x1b[?25h'
+        self.flush()
+
+class NullBackend(Backend):
+    """
+    Backend which draws nothing and just counts what it was asked to do
+    """
+    def __init__(self):
+        self.calls = 0
+        self.frames = 0
+    def init_colors(self, colordefs):
+        pass
+    def clear(self):
+        self.calls += 1
+    def border(self):
+        self.calls += 1
+    def hline(self, y, x, ch, n):
+        self.calls += 1
+    def vline(self, y, x, ch, n):
+        self.calls += 1
+    def text(self, y, x, s, standout=False):
+        self.calls += 1
+    def cell(self, y, x, ch, color=0):
+        self.calls += 1
+    def flush(self):
+        self.frames += 1
+
+def get_curses_color(name):
+    import curses
+    if name == "black":
+        return curses.COLOR_BLACK
+    elif name == "blue":
+        return curses.COLOR_BLUE
+    elif name == "cyan":
+        return curses.COLOR_CYAN
+    elif name == "green":
+        return curses.COLOR_GREEN
+    elif name == "magenta":
+        return curses.COLOR_MAGENTA
+    elif name == "red":
+        return curses.COLOR_RED
+    elif name == "white":
+        return curses.COLOR_WHITE
+    elif name == "yellow":
+        return curses.COLOR_YELLOW
+    else:
+        return None
+
+def benchmark(backend, frames=1000, block_type="Tetrominoes"):
+    """
+    Plays a game with random input onto the passed backend without
+    needing a terminal
+
+    Returns the number of seconds spent
+    """
+    import curses, datetime, random, time
+    from game import load_data
+    from states import StateManager
+    from play import GameState
+    colordefs, block_types = load_data()
+    backend.init_colors(colordefs)
+    keys = [curses.KEY_LEFT, curses.KEY_RIGHT, curses.KEY_UP, -1]
+    delta = datetime.timedelta(seconds=1/30)
+    manager = StateManager(GameState(block_types[block_type]))
+    start = time.perf_counter()
+    for i in range(frames):
+        if manager.active_state is None:
+            manager.push_state(GameState(block_types[block_type]))
+        manager.input(random.choice(keys))
+        manager.render(backend, delta)
+        backend.flush()
+    return time.perf_counter() - start
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description=\
+        "Measure the render path without a terminal")
+    parser.add_argument("--frames", type=int, default=1000)
+    args = parser.parse_args()
+    null = NullBackend()
+    t = benchmark(null, args.frames)
+    print("null: %.3f ms/frame, %.1f draw calls/frame" %\
+          (t * 1000 / args.frames, null.calls / args.frames))
+    fd = os.open(os.devnull, os.O_WRONLY)
+    ansi = AnsiBackend(fd, os.terminal_size((80, 24)))
+    t = benchmark(ansi, args.frames)
+    os.close(fd)
+    print("ansi: %.3f ms/frame, %.2f writes/frame, %.0f bytes/frame" %\
+          (t * 1000 / args.frames, ansi.writes / args.frames,\
+           ansi.bytes / args.frames))
@@ -0,0 +1,331 @@
+#!/usr/bin/python3
+"""
+Replay module for tetris
+
+Stores finished games in an append-only corpus file. Each record is a
+fixed-layout header followed by the game's input log:
+
+    seed         unsigned 64 bit
+    piece set    16 bytes, utf-8, padded with zeros
+    score        unsigned 32 bit
+    lines        unsigned 32 bit
+    level        unsigned 16 bit
+    input count  unsigned 32 bit
+    inputs       (frame, key) pairs of unsigned 32 and 16 bit
+
+Games are played with MasterTetris.tick, which doesn't depend on the
+clock, so a seed and an input log always give the same game. Frame n
+applies every input logged for frame n, in order, and then ticks once.
+The game ends when a tick returns false. A game that was stopped before
+then ends its log with a STOP input at the frame it stopped on.
+
+A separate index file holds the 64 bit offset of every record so that
+any game can be found without reading the ones before it. Readers map
+both files into memory and unpack fields in place, so nothing is ever
+unpickled or copied out of the file unless asked for.
+"""
+
+import collections, mmap, os, struct
+
+MAGIC = b'TETRISRP\x01\x00\x00\x00'
+RECORD = struct.Struct('<Q16sIIHI')
+INPUT = struct.Struct('<IH')
+OFFSET = struct.Struct('<Q')
+STOP = 0 # key logged when a game is stopped before it ends
+
+class ReplayFormatException(Exception):
+    """
+    Exception raised when a corpus file is not in the expected format
+    """
+    def __init__(self, reason):
+        self.reason = reason
+    def __str__(self):
+        return repr(self.reason)
+
+class ReplayWriter(object):
+    """
+    Appends game records to a corpus and its index
+    """
+    def __init__(self, path):
+        """
+        Opens the corpus at path for appending, creating it if needed.
+        The index is kept next to it at path + '.idx'.
+        """
+        self.path = path
+        self.data = open(path, 'ab')
+        self.index = open(path + '.idx', 'ab')
+        if self.data.tell() == 0:
+            self.data.write(MAGIC)
+    def append(self, seed, piece_set, inputs, score, lines, level):
+        """
+        Appends a game to the corpus
+
+        inputs: Sequence of (frame, key) tuples in the order they were
+          received
+
+        Returns the index of the new record
+        """
+        name = piece_set.encode('utf-8')
+        if len(name) > 16:
+            raise ValueError("Piece set name too long: %s" % piece_set)
+        inputs = list(inputs)
+        buf = bytearray(RECORD.size + INPUT.size * len(inputs))
+        RECORD.pack_into(buf, 0, seed, name, score, lines, level,\
+                         len(inputs))
+        for i in range(len(inputs)):
+            INPUT.pack_into(buf, RECORD.size + INPUT.size * i, *inputs[i])
+        offset = self.data.tell()
+        self.data.write(buf)
+        # the record must be on disk before the index points at it
+        self.data.flush()
+        self.index.write(OFFSET.pack(offset))
+        self.index.flush()
+        return self.index.tell() // OFFSET.size - 1
+    def close(self):
+        self.data.close()
+        self.index.close()
+    def __enter__(self):
+        return self
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+class GameRecord(object):
+    """
+    View of a single game inside a mapped corpus
+
+    Fields are unpacked from the mapping when they are read.
+    """
+    def __init__(self, buffer, offset):
+        self.buffer = buffer
+        self.offset = offset
+    @property
+    def header(self):
+        """
+        Returns (seed, piece_set, score, lines, level, input_count)
+        """
+        h = RECORD.unpack_from(self.buffer, self.offset)
+        return (h[0], h[1].rstrip(b'\0').decode('utf-8')) + h[2:]
+    @property
+    def seed(self):
+        return self.header[0]
+    @property
+    def piece_set(self):
+        return self.header[1]
+    @property
+    def score(self):
+        return self.header[2]
+    @property
+    def lines(self):
+        return self.header[3]
+    @property
+    def level(self):
+        return self.header[4]
+    @property
+    def size(self):
+        """
+        Returns the size of this record in bytes
+        """
+        return RECORD.size + INPUT.size * self.header[5]
+    @property
+    def raw_inputs(self):
+        """
+        Returns a memoryview of the packed input log
+
+        The view should be released before the corpus is closed. Until
+        it is, closing the corpus leaves the mapping open.
+        """
+        start = self.offset + RECORD.size
+        return memoryview(self.buffer)[start:self.offset + self.size]
+    @property
+    def inputs(self):
+        """
+        Iterates the input log as (frame, key) tuples. Each input is
+        unpacked from the mapping as it is reached, so no view of the
+        mapping is held between steps.
+        """
+        offset = self.offset + RECORD.size
+        end = self.offset + self.size
+        while offset < end:
+            yield INPUT.unpack_from(self.buffer, offset)
+            offset += INPUT.size
+
+class ReplayCorpus(object):
+    """
+    Memory-mapped, read-only view of a corpus and its index
+    """
+    def __init__(self, path):
+        self.path = path
+        self.__files = []
+        # the index is mapped first so that every record it points at
+        # was written before the data is mapped
+        self.index = self.__map(path + '.idx')
+        self.data = self.__map(path)
+        if self.data[:len(MAGIC)] != MAGIC:
+            raise ReplayFormatException("%s is not a replay corpus" % path)
+    def __map(self, path):
+        f = open(path, 'rb')
+        self.__files.append(f)
+        if os.fstat(f.fileno()).st_size == 0:
+            return b''
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    def __len__(self):
+        return len(self.index) // OFFSET.size
+    def __getitem__(self, n):
+        """
+        Returns game n in constant time
+        """
+        if n < 0:
+            n += len(self)
+        if n < 0 or n >= len(self):
+            raise IndexError(n)
+        offset = OFFSET.unpack_from(self.index, n * OFFSET.size)[0]
+        if offset + RECORD.size > len(self.data):
+            raise ReplayFormatException("Game %i is past the end of %s" %\
+                                        (n, self.path))
+        record = GameRecord(self.data, offset)
+        if offset + record.size > len(self.data):
+            raise ReplayFormatException("Game %i is cut off in %s" %\
+                                        (n, self.path))
+        return record
+    def __iter__(self):
+        """
+        Streams the games in file order without using the index. A
+        game still being written at the end of the file is left out.
+        """
+        offset = len(MAGIC)
+        end = len(self.data)
+        while offset + RECORD.size <= end:
+            record = GameRecord(self.data, offset)
+            if offset + record.size > end:
+                return
+            yield record
+            offset += record.size
+    def results(self):
+        """
+        Iterates (score, lines, level) for every game, reading only the
+        record headers
+        """
+        data = self.data
+        offset = len(MAGIC)
+        end = len(data)
+        unpack = RECORD.unpack_from
+        while offset + RECORD.size <= end:
+            h = unpack(data, offset)
+            size = RECORD.size + INPUT.size * h[5]
+            if offset + size > end:
+                return
+            yield h[2:5]
+            offset += size
+    def histogram(self, width=100, field=0):
+        """
+        Returns a histogram of the scores as a dict of bin start to count
+
+        width: Width of each bin
+        field: Which result to use. 0 for score, 1 for lines, 2 for level
+        """
+        counts = collections.Counter()
+        for r in self.results():
+            counts[r[field] // width * width] += 1
+        return dict(sorted(counts.items()))
+    def close(self):
+        for m in (self.data, self.index):
+            if isinstance(m, mmap.mmap):
+                try:
+                    m.close()
+                except BufferError:
+                    # a raw_inputs view is still alive. The mapping is
+                    # freed along with the last view instead.
+                    pass
+        for f in self.__files:
+            f.close()
+    def __enter__(self):
+        return self
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+def key_actions(game):
+    """
+    Returns a dict of the logged keys to the game's actions
+    """
+    import curses
+    return { curses.KEY_LEFT: game.left,\
+             curses.KEY_RIGHT: game.right,\
+             curses.KEY_UP: game.rotate_left,\
+             curses.KEY_DOWN: game.down }
+
+def replay(record, factories):
+    """
+    Plays a record's input log back on a new game
+
+    factories: Polyomino factories of the record's piece set
+
+    Returns the game as it was when the record ended
+    """
+    from game import MasterTetris
+    game = MasterTetris((0, 0), factories, record.seed)
+    actions = key_actions(game)
+    inputs = record.inputs
+    pending = next(inputs, None)
+    frame = 0
+    while True:
+        while pending is not None and pending[0] == frame:
+            if pending[1] == STOP:
+                return game
+            actions[pending[1]]()
+            pending = next(inputs, None)
+        if not game.tick():
+            return game
+        frame += 1
+
+def simulate(writer, games, block_type="Tetrominoes", frames=10000,\
+             seed=0):
+    """
+    Plays games with random input into the passed writer. Useful for
+    building corpora to try readers against.
+
+    frames: Most frames to play each game for
+    """
+    import random
+    from game import MasterTetris, load_data
+    colordefs, block_types = load_data()
+    chooser = random.Random(seed)
+    for g in range(games):
+        game_seed = chooser.getrandbits(64)
+        game = MasterTetris((0, 0), block_types[block_type], game_seed)
+        actions = key_actions(game)
+        keys = sorted(actions.keys())
+        inputs = []
+        for frame in range(frames + 1):
+            if frame == frames:
+                inputs.append((frame, STOP))
+                break
+            if chooser.random() < 0.3:
+                key = chooser.choice(keys)
+                actions[key]()
+                inputs.append((frame, key))
+            if not game.tick():
+                break
+        writer.append(game_seed, block_type, inputs, game.score,\
+                      game.lines, game.level)
+
+if __name__ == "__main__":
+    import argparse, time
+    parser = argparse.ArgumentParser(description=\
+        "Summarize a replay corpus")
+    parser.add_argument("corpus")
+    parser.add_argument("--generate", type=int, default=0,\
+                        help="append this many simulated games first")
+    parser.add_argument("--width", type=int, default=1,\
+                        help="score histogram bin width")
+    args = parser.parse_args()
+    if args.generate > 0:
+        with ReplayWriter(args.corpus) as writer:
+            simulate(writer, args.generate)
+    with ReplayCorpus(args.corpus) as corpus:
+        start = time.perf_counter()
+        histogram = corpus.histogram(args.width)
+        elapsed = time.perf_counter() - start
+        print("%i games, histogram in %.3f ms" % (len(corpus),\
+                                                   elapsed * 1000))
+        for score in histogram:
+            print("%8i: %i" % (score, histogram[score]))
@@ -0,0 +1,285 @@
+#!/usr/bin/python3
+"""
+Rollback module for tetris
+
+Lets a networked versus game run the local player's inputs without
+waiting for the remote player. The remote player's game is predicted
+and, when their real inputs arrive late and differ from the prediction,
+both games are returned to the last frame that was known to be right
+and simulated forward again.
+
+Games are stepped with MasterTetris.tick so that the same inputs always
+give the same result, and a snapshot is taken before every frame into a
+ring buffer covering the rollback window.
+"""
+
+import heapq, random, time
+from events import Event
+
+LEFT = 1
+RIGHT = 2
+DOWN = 4
+ROTATE_LEFT = 8
+ROTATE_RIGHT = 16
+HELD = LEFT | RIGHT | DOWN # inputs which are predicted to continue
+
+def apply_input(game, mask):
+    """
+    Performs the actions in an input mask on a game
+    """
+    if mask & ROTATE_LEFT:
+        game.rotate_left()
+    if mask & ROTATE_RIGHT:
+        game.rotate_right()
+    if mask & LEFT:
+        game.left()
+    if mask & RIGHT:
+        game.right()
+    if mask & DOWN:
+        game.down()
+
+class RollbackException(Exception):
+    """
+    Exception raised when an input arrives too late to be rolled back to
+    """
+    def __init__(self, reason):
+        self.reason = reason
+    def __str__(self):
+        return repr(self.reason)
+
+class RollbackSession(object):
+    """
+    Keeps a local game and a predicted remote game in step
+
+    Call advance once per frame with the local input and receive for
+    every remote input that arrives. The remote player's missing inputs
+    are predicted by continuing whatever movement they were last known
+    to be holding.
+    """
+    def __init__(self, local, remote, window=8, budget=1/60):
+        """
+        local: The local player's MasterTetris
+        remote: The remote player's SlaveTetris
+        window: Most frames we may run ahead of the remote player's
+          confirmed inputs
+        budget: Seconds a rollback should fit in. Rollbacks that take
+          longer are counted as overruns.
+        """
+        self.local = local
+        self.remote = remote
+        self.window = window
+        self.budget = budget
+        self.frame = 0 # next frame to simulate
+        self.confirmed = -1 # every remote input up to here has arrived
+        self.verified = -1 # frames up to here were simulated correctly
+        self.local_inputs = {}
+        self.remote_inputs = {}
+        self.predicted = {} # remote inputs each frame was simulated with
+        self.states = [None] * (window + 2)
+        self.over = (False, False)
+        self.rollbacks = [] # (frames simulated again, seconds) each
+        self.overruns = 0
+    @property
+    def stalled(self):
+        """
+        Returns true if we are too far ahead of the remote player and
+        have to wait for their inputs
+        """
+        return self.frame - self.confirmed > self.window
+    def __predict(self, frame):
+        if frame in self.remote_inputs:
+            return self.remote_inputs[frame]
+        return self.remote_inputs.get(self.confirmed, 0) & HELD
+    def __simulate(self):
+        """
+        Saves a snapshot and simulates the next frame
+        """
+        f = self.frame
+        self.states[f % len(self.states)] = (f, self.local.save_state(),\
+            self.remote.save_state(), self.over)
+        remote = self.__predict(f)
+        self.predicted[f] = remote
+        over = list(self.over)
+        for i, game, mask in ((0, self.local, self.local_inputs[f]),\
+                              (1, self.remote, remote)):
+            if not over[i]:
+                apply_input(game, mask)
+                over[i] = not game.tick()
+        self.over = tuple(over)
+        self.frame += 1
+    def sync(self):
+        """
+        Rolls back and simulates again if any frame was simulated with a
+        remote input that turned out to be wrong
+        """
+        start = None
+        for f in range(self.verified + 1, self.frame):
+            if self.predicted[f] != self.__predict(f):
+                start = f
+                break
+        if start is not None:
+            began = time.perf_counter()
+            end = self.frame
+            frame, local, remote, over = self.states[start % len(self.states)]
+            if frame != start:
+                raise RollbackException("Frame %i is no longer saved" % start)
+            # nobody needs to see the frames in between
+            with self.local.event, self.remote.event:
+                self.local.load_state(local)
+                self.remote.load_state(remote)
+                self.over = over
+                self.frame = start
+                while self.frame < end:
+                    self.__simulate()
+            for game in (self.local, self.remote):
+                game.event(Event(game, "state-loaded"))
+            elapsed = time.perf_counter() - began
+            self.rollbacks.append((end - start, elapsed))
+            if elapsed > self.budget:
+                self.overruns += 1
+        self.verified = min(self.confirmed, self.frame - 1)
+    def advance(self, local_input):
+        """
+        Simulates the next frame with the passed local input mask
+
+        Returns false without doing anything if we have to wait for the
+        remote player
+        """
+        if self.stalled:
+            return False
+        self.sync()
+        self.local_inputs[self.frame] = local_input
+        self.__simulate()
+        # forget inputs we can no longer roll back to
+        old = self.frame - len(self.states) - 1
+        for inputs in (self.local_inputs, self.predicted,\
+                       self.remote_inputs):
+            if old in inputs and old != self.confirmed:
+                del inputs[old]
+        return True
+    def receive(self, frame, remote_input):
+        """
+        Records the remote player's input for a frame. Inputs may arrive
+        in any order.
+        """
+        if frame <= self.confirmed or frame in self.remote_inputs:
+            return # already have it
+        if frame < self.frame - len(self.states):
+            raise RollbackException("Input for frame %i arrived too late" %\
+                                    frame)
+        self.remote_inputs[frame] = remote_input
+        while self.confirmed + 1 in self.remote_inputs:
+            self.confirmed += 1
+
+class LoopbackLink(object):
+    """
+    One-way link which delivers messages after a number of frames
+
+    Each message is delayed by the latency plus a random jitter, so
+    messages can arrive out of order.
+    """
+    def __init__(self, latency=0, jitter=0, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.random = random.Random(seed)
+        self.queue = []
+        self.sent = 0
+    def send(self, now, message):
+        delay = self.latency + self.random.randint(0, self.jitter)
+        heapq.heappush(self.queue, (now + delay, self.sent, message))
+        self.sent += 1
+    def receive(self, now):
+        """
+        Returns the messages that have arrived by the passed frame
+        """
+        arrived = []
+        while len(self.queue) > 0 and self.queue[0][0] <= now:
+            arrived.append(heapq.heappop(self.queue)[2])
+        return arrived
+    def __len__(self):
+        return len(self.queue)
+
+def simulate(frames=1200, latency=4, jitter=3, window=12, seed=0,\
+             block_type="Tetrominoes"):
+    """
+    Plays two peers with random input against each other over loopback
+    links and checks that each ends up with the same games as the other
+
+    Returns a dict of statistics about the rollbacks
+    """
+    from game import MasterTetris, SlaveTetris, load_data
+    colordefs, block_types = load_data()
+    blocks = block_types[block_type]
+    chooser = random.Random(seed)
+    seeds = (chooser.getrandbits(32), chooser.getrandbits(32))
+    peers = []
+    for i in range(2):
+        session = RollbackSession(\
+            MasterTetris((0, 0), blocks, seeds[i]),\
+            SlaveTetris((0, 0), blocks, seeds[1 - i]), window)
+        peers.append((session, LoopbackLink(latency, jitter, seed + i),\
+                      random.Random(seed + 10 + i)))
+    masks = [0] * 12 + [LEFT, RIGHT, DOWN, ROTATE_LEFT, ROTATE_RIGHT]
+    stalls = 0
+    now = 0
+    while True:
+        done = True
+        for i in range(2):
+            session, link, rnd = peers[i]
+            other = peers[1 - i][1]
+            for frame, mask in other.receive(now):
+                session.receive(frame, mask)
+            if session.frame >= frames:
+                continue
+            done = False
+            mask = rnd.choice(masks)
+            frame = session.frame
+            if session.advance(mask):
+                link.send(now, (frame, mask))
+            else:
+                stalls += 1
+        now += 1
+        if done and len(peers[0][1]) == 0 and len(peers[1][1]) == 0:
+            break
+    for session, link, rnd in peers:
+        session.sync()
+    a = peers[0][0]
+    b = peers[1][0]
+    consistent = a.local.save_state() == b.remote.save_state() and\
+                 a.remote.save_state() == b.local.save_state()
+    rollbacks = a.rollbacks + b.rollbacks
+    resimulated = [r[0] for r in rollbacks] or [0]
+    seconds = [r[1] for r in rollbacks] or [0]
+    return {
+        "frames": frames,
+        "consistent": consistent,
+        "stalls": stalls,
+        "rollbacks": len(rollbacks),
+        "frames_per_rollback": sum(resimulated) / len(resimulated),
+        "max_frames": max(resimulated),
+        "ms_per_rollback": sum(seconds) / len(seconds) * 1000,
+        "max_ms": max(seconds) * 1000,
+        "overruns": a.overruns + b.overruns,
+    }
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description=\
+        "Measure rollbacks between two peers over a lossy loopback link")
+    parser.add_argument("--frames", type=int, default=1200)
+    parser.add_argument("--latency", type=int, default=4,\
+                        help="link latency in frames")
+    parser.add_argument("--jitter", type=int, default=3,\
+                        help="most extra frames a message can be delayed")
+    parser.add_argument("--window", type=int, default=12)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    r = simulate(args.frames, args.latency, args.jitter, args.window,\
+                 args.seed)
+    print("%i frames, %s, %i stalls, %i rollbacks re-simulating "\
+          "%.1f frames (max %i) in %.3f ms (max %.3f ms), "\
+          "%i over the frame budget" %\
+          (r["frames"], "consistent" if r["consistent"] else "DESYNCED",\
+           r["stalls"], r["rollbacks"], r["frames_per_rollback"],\
+           r["max_frames"], r["ms_per_rollback"], r["max_ms"],\
+           r["overruns"]))
@@ -0,0 +1,380 @@
+#!/usr/bin/python3
+"""
+Solver module for tetris
+
+Searches for placement sequences on a board given a known sequence of
+pieces, either to clear as many lines as possible or to find the
+shortest perfect clear (an empty board).
+
+Pieces are dropped straight down from above the board in any of their
+distinct orientations, following the same rules as Grid: the board is
+open at the top and a piece that locks with a block above the first row
+tops out. Slides and spins under overhangs are not searched.
+
+The search is an iterative deepening depth-first search. Positions are
+hashed with Zobrist keys and remembered in a transposition table with
+least recently used eviction. Orientations that look the same (such as
+every rotation of the box) are only tried once, and placements that
+lead to a board already seen from the same position are skipped.
+"""
+
+import collections, random, time
+
+class Shape(object):
+    """
+    One orientation of a piece, normalized so its top left is (0,0)
+    """
+    def __init__(self, name, cells, rotation):
+        """
+        name: Name of the piece
+        cells: (x,y) tuples of the blocks in this orientation
+        rotation: Number of left rotations from the piece as loaded
+        """
+        min_x = min(c[0] for c in cells)
+        min_y = min(c[1] for c in cells)
+        self.name = name
+        self.rotation = rotation
+        self.cells = tuple(sorted((c[0] - min_x, c[1] - min_y)\
+                                  for c in cells))
+        self.width = max(c[0] for c in self.cells) + 1
+        self.height = max(c[1] for c in self.cells) + 1
+        self.masks = [0] * self.height # bits of each row of the shape
+        for x, y in self.cells:
+            self.masks[y] |= 1 << x
+
+def orientations(name, tuples):
+    """
+    Returns the distinct orientations of a piece, rotating it left the
+    same way Polyomino.rotate_left does
+    """
+    shapes = []
+    seen = set()
+    cells = list(tuples)
+    for rotation in range(4):
+        shape = Shape(name, cells, rotation)
+        if shape.cells not in seen:
+            seen.add(shape.cells)
+            shapes.append(shape)
+        cells = [(-y, x) for x, y in cells]
+    return shapes
+
+class TranspositionTable(object):
+    """
+    Fixed size table of search results which evicts the least recently
+    used entry when full
+    """
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.entries = collections.OrderedDict()
+        self.hits = 0
+        self.evictions = 0
+    def get(self, key):
+        value = self.entries.get(key)
+        if value is not None:
+            self.entries.move_to_end(key)
+            self.hits += 1
+        return value
+    def put(self, key, value):
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.capacity:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+    def clear(self):
+        self.entries.clear()
+        self.hits = 0
+        self.evictions = 0
+    def __len__(self):
+        return len(self.entries)
+
+class Placement(object):
+    """
+    A piece locked at a position. column and row are the grid position
+    of the top left of the piece's orientation.
+    """
+    def __init__(self, shape, column, row, lines):
+        self.shape = shape
+        self.column = column
+        self.row = row
+        self.lines = lines # lines cleared by this placement
+    def __str__(self):
+        return "%s rotated %i at column %i, row %i (%i lines)" %\
+            (self.shape.name, self.shape.rotation, self.column, self.row,\
+             self.lines)
+
+class Solution(object):
+    """
+    Result of a search
+    """
+    def __init__(self, placements, depth, nodes, seconds):
+        self.placements = placements
+        self.depth = depth # deepest search completed
+        self.nodes = nodes
+        self.seconds = seconds
+    @property
+    def lines(self):
+        return sum(p.lines for p in self.placements)
+    @property
+    def nodes_per_second(self):
+        return self.nodes / self.seconds if self.seconds > 0 else 0
+
+class Solver(object):
+    """
+    Searches placements for a sequence of pieces
+
+    Boards are lists of row bitmasks from the top row down, with bit x
+    set when column x is filled.
+    """
+    def __init__(self, factories, width=10, height=20,\
+                 table_size=1 << 20, seed=0):
+        """
+        factories: Polyomino factories with names, as loaded from the
+          data file
+        table_size: Number of entries kept in the transposition table
+        """
+        self.width = width
+        self.height = height
+        self.full = (1 << width) - 1
+        self.shapes = {}
+        self.sizes = {}
+        for f in factories:
+            self.shapes[f.name] = orientations(f.name, f.tuples)
+            self.sizes[f.name] = len(f.tuples)
+        rng = random.Random(seed)
+        self.zobrist = [[rng.getrandbits(64) for x in range(width)]\
+                        for y in range(height)]
+        # entries only hold for the sequence being solved, so the table
+        # is cleared by every call to solve
+        self.table = TranspositionTable(table_size)
+        self.nodes = 0
+    def hash(self, rows):
+        """
+        Returns the Zobrist hash of a board
+        """
+        h = 0
+        for y in range(self.height):
+            row = rows[y]
+            x = 0
+            while row:
+                if row & 1:
+                    h ^= self.zobrist[y][x]
+                row >>= 1
+                x += 1
+        return h
+    def placements(self, rows, name):
+        """
+        Yields (placement, rows) for every way to drop the named piece
+        onto the board
+        """
+        height = self.height
+        for shape in self.shapes[name]:
+            for x in range(self.width - shape.width + 1):
+                masks = [m << x for m in shape.masks]
+                # the board is open at the top, so start above it and
+                # fall until something is in the way
+                y = -shape.height
+                while True:
+                    below = y + 1
+                    blocked = False
+                    for dy in range(shape.height):
+                        r = below + dy
+                        if r >= height or (r >= 0 and rows[r] & masks[dy]):
+                            blocked = True
+                            break
+                    if blocked:
+                        break
+                    y = below
+                if y < 0:
+                    continue # tops out
+                new = list(rows)
+                for dy in range(shape.height):
+                    new[y + dy] |= masks[dy]
+                kept = [r for r in new if r != self.full]
+                lines = height - len(kept)
+                if lines > 0:
+                    new = [0] * lines + kept
+                yield (Placement(shape, x, y, lines), new)
+    def __child_hash(self, h, placement, rows):
+        if placement.lines > 0:
+            return self.hash(rows)
+        for cx, cy in placement.shape.cells:
+            h ^= self.zobrist[placement.row + cy][placement.column + cx]
+        return h
+    def __lines(self, rows, h, filled, sequence, i, limit):
+        """
+        Returns (lines, placements) for the most lines that can be
+        cleared placing pieces i up to limit
+        """
+        if i == limit:
+            return (0, ())
+        key = (h, i, limit - i)
+        entry = self.table.get(key)
+        if entry is not None:
+            return entry
+        remaining = sum(self.sizes[n] for n in sequence[i:limit])
+        bound = (filled + remaining) // self.width
+        best = (0, ())
+        seen = set()
+        size = self.sizes[sequence[i]]
+        for placement, new in self.placements(rows, sequence[i]):
+            self.nodes += 1
+            nh = self.__child_hash(h, placement, new)
+            if nh in seen:
+                continue
+            seen.add(nh)
+            sub = self.__lines(new, nh,\
+                filled + size - placement.lines * self.width,\
+                sequence, i + 1, limit)
+            total = placement.lines + sub[0]
+            if total > best[0] or len(best[1]) == 0:
+                best = (total, (placement,) + sub[1])
+            if best[0] >= bound:
+                break # nothing can do better
+        self.table.put(key, best)
+        return best
+    def __perfect(self, rows, h, filled, sequence, i, limit):
+        """
+        Returns the placements for a perfect clear using at most pieces
+        i up to limit, or None
+        """
+        if i == limit:
+            return None
+        key = (h, i)
+        proven = self.table.get(key) # depth with no perfect clear
+        if proven is not None and proven >= limit - i:
+            return None
+        # every row with a block in it must be cleared
+        occupied = sum(1 for r in rows if r)
+        remaining = sum(self.sizes[n] for n in sequence[i:limit])
+        if occupied * self.width > filled + remaining:
+            self.table.put(key, limit - i)
+            return None
+        seen = set()
+        size = self.sizes[sequence[i]]
+        for placement, new in self.placements(rows, sequence[i]):
+            self.nodes += 1
+            left = filled + size - placement.lines * self.width
+            if left == 0:
+                return (placement,)
+            nh = self.__child_hash(h, placement, new)
+            if nh in seen:
+                continue
+            seen.add(nh)
+            sub = self.__perfect(new, nh, left, sequence, i + 1, limit)
+            if sub is not None:
+                return (placement,) + sub
+        self.table.put(key, limit - i)
+        return None
+    def solve(self, rows, sequence, perfect=False, max_depth=None,\
+              time_limit=None):
+        """
+        Searches for the best placements of the pieces in sequence
+
+        rows: Starting board
+        sequence: Names of the pieces in the order they will come
+        perfect: If true, search for the shortest perfect clear instead
+          of the most lines
+        max_depth: Most pieces to place. Defaults to the whole sequence
+        time_limit: Seconds after which no deeper search is started
+
+        Returns a Solution. When searching for a perfect clear and none
+        is found, the solution has no placements.
+        """
+        for name in sequence:
+            if name not in self.shapes:
+                raise ValueError("Unknown piece: %s" % name)
+        if max_depth is None or max_depth > len(sequence):
+            max_depth = len(sequence)
+        rows = list(rows)
+        h = self.hash(rows)
+        filled = sum(bin(r).count('1') for r in rows)
+        self.table.clear()
+        self.nodes = 0
+        start = time.perf_counter()
+        best = ()
+        depth = 0
+        for limit in range(1, max_depth + 1):
+            if perfect:
+                found = self.__perfect(rows, h, filled, sequence, 0, limit)
+                depth = limit
+                if found is not None:
+                    best = found
+                    break
+            else:
+                best = self.__lines(rows, h, filled, sequence, 0, limit)[1]
+                depth = limit
+            if time_limit is not None and\
+                    time.perf_counter() - start > time_limit:
+                break
+        return Solution(list(best), depth, self.nodes,\
+                        time.perf_counter() - start)
+
+def parse_board(text, width=10, height=20):
+    """
+    Parses a board drawn with '.' for empty cells and any other
+    character for filled cells. The last line is the bottom row.
+    """
+    lines = [l for l in text.splitlines() if l.strip()]
+    if len(lines) > height:
+        raise ValueError("Board is taller than %i rows" % height)
+    rows = [0] * (height - len(lines))
+    for l in lines:
+        row = 0
+        for x, c in enumerate(l.strip()[:width]):
+            if c != '.':
+                row |= 1 << x
+        rows.append(row)
+    return rows
+
+def board_from_grid(grid):
+    """
+    Returns the board for a game Grid
+    """
+    rows = []
+    for y in range(grid.height):
+        row = 0
+        for x in range(grid.width):
+            if not grid.is_clear((x, y)):
+                row |= 1 << x
+        rows.append(row)
+    return rows
+
+if __name__ == "__main__":
+    import argparse, sys
+    from game import load_data
+    parser = argparse.ArgumentParser(description=\
+        "Search placements for a known sequence of pieces")
+    parser.add_argument("pieces", help="comma separated piece names")
+    parser.add_argument("--type", default="Tetrominoes",\
+                        help="block type from the data file")
+    parser.add_argument("--board", help="file with the starting board")
+    parser.add_argument("--perfect", action="store_true",\
+                        help="search for the shortest perfect clear")
+    parser.add_argument("--depth", type=int)
+    parser.add_argument("--time", type=float,\
+                        help="seconds after which to stop deepening")
+    parser.add_argument("--table-size", type=int, default=1 << 20)
+    parser.add_argument("--width", type=int, default=10)
+    parser.add_argument("--height", type=int, default=20)
+    args = parser.parse_args()
+    colordefs, block_types = load_data()
+    solver = Solver(block_types[args.type], args.width, args.height,\
+                    args.table_size)
+    rows = [0] * args.height
+    if args.board is not None:
+        with open(args.board) as f:
+            rows = parse_board(f.read(), args.width, args.height)
+    try:
+        solution = solver.solve(rows, args.pieces.split(','),\
+                                args.perfect, args.depth, args.time)
+    except ValueError as e:
+        sys.exit(str(e))
+    if args.perfect and len(solution.placements) == 0:
+        print("No perfect clear within %i pieces" % solution.depth)
+    for p in solution.placements:
+        print(p)
+    print("%i lines, depth %i, %i nodes in %.3f s (%.0f nodes/s), "\
+          "%i table entries, %i hits, %i evictions" %\
+          (solution.lines, solution.depth, solution.nodes,\
+           solution.seconds, solution.nodes_per_second,\
+           len(solver.table), solver.table.hits, solver.table.evictions))
@@ -0,0 +1,369 @@
+#!/usr/bin/python3
+"""
+Spectator module for tetris
+
+Streams a live game to any number of read-only watchers. This follows
+the design of NetworkTetrisHost, except that watchers never send
+anything back.
+
+Each message on the stream is a header of (type, payload length)
+followed by the payload. A new watcher first receives a keyframe of the
+whole board and then a delta for every frame in which the board changed.
+
+Keyframe payload: width and height as bytes, one occupancy bit per cell
+(row-major, least significant bit first) and then one color nibble per
+occupied cell.
+
+Delta payload: the number of changed cells followed by (index, color)
+for each changed cell, where a color of 0 means the cell is empty.
+
+Every message is encoded once and the same buffer is queued for each
+watcher, so the encoding cost does not depend on the number of watchers.
+"""
+
+import collections, selectors, socket, struct
+
+KEYFRAME = 1
+DELTA = 2
+HEADER = struct.Struct('>BI')
+DELTA_COUNT = struct.Struct('>H')
+DELTA_CELL = struct.Struct('>HB')
+
+def snapshot(game):
+    """
+    Returns the cells of the passed game's grid as a row-major bytearray
+    of color ids, including the falling piece
+    """
+    grid = game.grid
+    cells = bytearray(grid.width * grid.height)
+    for y in range(grid.height):
+        row = grid.row(y)
+        if row.count == 0:
+            continue
+        for x in range(grid.width):
+            b = row.cells[x]
+            if b is not None:
+                cells[y * grid.width + x] = b.color
+    if game.current_piece is not None:
+        origin = grid.position
+        for b in game.current_piece.blocks:
+            x = b.position[0] - origin[0]
+            y = b.position[1] - origin[1]
+            if 0 <= x < grid.width and 0 <= y < grid.height:
+                cells[y * grid.width + x] = b.color
+    return cells
+
+def encode_keyframe(width, height, cells):
+    """
+    Encodes a keyframe message for the passed cells
+    """
+    bits = 0
+    colors = []
+    for i in range(len(cells)):
+        if cells[i]:
+            if cells[i] > 0xf:
+                raise ValueError("Color %i does not fit in a nibble" %\
+                                 cells[i])
+            bits |= 1 << i
+            colors.append(cells[i])
+    if len(colors) % 2:
+        colors.append(0)
+    payload = bytearray((width, height))
+    payload += bits.to_bytes((len(cells) + 7) // 8, 'little')
+    payload += bytes(colors[i] << 4 | colors[i + 1]\
+                     for i in range(0, len(colors), 2))
+    return HEADER.pack(KEYFRAME, len(payload)) + payload
+
+def decode_keyframe(payload):
+    """
+    Decodes a keyframe payload, returning (width, height, cells)
+    """
+    width = payload[0]
+    height = payload[1]
+    count = width * height
+    size = (count + 7) // 8
+    bits = int.from_bytes(payload[2:2 + size], 'little')
+    nibbles = payload[2 + size:]
+    cells = bytearray(count)
+    n = 0
+    for i in range(count):
+        if bits >> i & 1:
+            packed = nibbles[n // 2]
+            cells[i] = packed & 0xf if n % 2 else packed >> 4
+            n += 1
+    return (width, height, cells)
+
+def encode_delta(last, cells):
+    """
+    Encodes a delta message turning last into cells. Returns None if
+    nothing changed.
+    """
+    changed = [i for i in range(len(cells)) if cells[i] != last[i]]
+    if len(changed) == 0:
+        return None
+    payload = bytearray(DELTA_COUNT.pack(len(changed)))
+    for i in changed:
+        payload += DELTA_CELL.pack(i, cells[i])
+    return HEADER.pack(DELTA, len(payload)) + payload
+
+def decode_delta(payload, cells):
+    """
+    Applies a delta payload to the passed cells
+    """
+    count = DELTA_COUNT.unpack_from(payload)[0]
+    for n in range(count):
+        i, color = DELTA_CELL.unpack_from(payload, DELTA_COUNT.size +\
+                                          n * DELTA_CELL.size)
+        cells[i] = color
+
+class SpectatorChannel(object):
+    """
+    Connection to a single watcher
+
+    Holds a queue of shared message buffers along with how far into the
+    first buffer we have sent.
+    """
+    def __init__(self, sock):
+        self.socket = sock
+        self.queue = collections.deque()
+        self.offset = 0
+        self.pending = 0 # bytes queued but not sent yet
+    def push(self, message):
+        self.queue.append(message)
+        self.pending += len(message)
+    def send(self):
+        """
+        Sends as much of the queue as the socket will take without
+        blocking. Returns the number of bytes sent.
+        """
+        sent = 0
+        while len(self.queue) > 0:
+            message = self.queue[0]
+            try:
+                n = self.socket.send(memoryview(message)[self.offset:])
+            except BlockingIOError:
+                break # the socket is full
+            sent += n
+            self.offset += n
+            if self.offset < len(message):
+                break # the socket is full
+            self.queue.popleft()
+            self.offset = 0
+        self.pending -= sent
+        return sent
+
+class SpectatorHost(object):
+    """
+    Host which streams a game to read-only watchers
+
+    The host is driven by calling poll once per frame. Changes to the
+    game are noted through its events and encoded on the next poll.
+    """
+    def __init__(self, game, host='127.0.0.1', port=0, backlog=128,\
+                 limit=1 << 16):
+        """
+        Starts listening for watchers of the passed game
+
+        limit: Number of unsent bytes after which a watcher is considered
+          too slow and is disconnected
+        """
+        self.game = game
+        self.limit = limit
+        self.channels = {}
+        self.cells = snapshot(game)
+        self.dirty = False
+        self.bytes_encoded = 0
+        self.bytes_sent = 0
+        self.__keyframe = None
+        self.selector = selectors.DefaultSelector()
+        self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.listener.bind((host, port))
+        self.listener.listen(backlog)
+        self.listener.setblocking(False)
+        self.selector.register(self.listener, selectors.EVENT_READ)
+        game.event += self.__on_game_event
+    @property
+    def address(self):
+        return self.listener.getsockname()
+    @property
+    def keyframe(self):
+        """
+        Returns the encoded keyframe for the current board. This is
+        shared by every watcher that joins before the board changes.
+        """
+        if self.__keyframe is None:
+            grid = self.game.grid
+            self.__keyframe = encode_keyframe(grid.width, grid.height,\
+                                              self.cells)
+            self.bytes_encoded += len(self.__keyframe)
+        return self.__keyframe
+    def __on_game_event(self, e):
+        self.dirty = True
+    def __accept(self):
+        while True:
+            try:
+                sock, address = self.listener.accept()
+            except BlockingIOError:
+                return
+            sock.setblocking(False)
+            channel = SpectatorChannel(sock)
+            channel.push(self.keyframe)
+            self.channels[sock] = channel
+            self.selector.register(sock, selectors.EVENT_READ, channel)
+    def __drop(self, channel):
+        del self.channels[channel.socket]
+        self.selector.unregister(channel.socket)
+        channel.socket.close()
+    def flush(self):
+        """
+        Encodes the changes to the board since the last flush and queues
+        them for every watcher
+        """
+        if not self.dirty:
+            return
+        self.dirty = False
+        cells = snapshot(self.game)
+        message = encode_delta(self.cells, cells)
+        if message is None:
+            return
+        self.cells = cells
+        self.__keyframe = None
+        self.bytes_encoded += len(message)
+        for channel in self.channels.values():
+            channel.push(message)
+    def poll(self, timeout=0):
+        """
+        Accepts new watchers, flushes the board and sends whatever the
+        watchers' sockets will take
+        """
+        for key, mask in self.selector.select(timeout):
+            if key.fileobj is self.listener:
+                self.__accept()
+            else:
+                # watchers never talk, so this is either a close or junk
+                try:
+                    data = key.fileobj.recv(4096)
+                except OSError:
+                    data = b''
+                if not data:
+                    self.__drop(key.data)
+        self.flush()
+        for channel in list(self.channels.values()):
+            if channel.pending == 0:
+                continue
+            try:
+                self.bytes_sent += channel.send()
+            except OSError:
+                self.__drop(channel)
+                continue
+            if channel.pending > self.limit:
+                self.__drop(channel)
+    def close(self):
+        self.game.event -= self.__on_game_event
+        for channel in list(self.channels.values()):
+            self.__drop(channel)
+        self.selector.unregister(self.listener)
+        self.listener.close()
+        self.selector.close()
+
+def measure(spectators, frames=600, block_type="Tetrominoes"):
+    """
+    Plays a game with random input while the passed number of loopback
+    watchers are connected.
+
+    Returns a dict with the bytes sent and the host CPU seconds spent
+    per watcher. Each watcher also decodes its stream and is checked
+    against the final board.
+    """
+    import datetime, random, time
+    from game import MasterTetris, load_data
+    colordefs, block_types = load_data()
+    game = MasterTetris((0, 0), block_types[block_type])
+    host = SpectatorHost(game)
+    clients = []
+    for i in range(spectators):
+        sock = socket.create_connection(host.address)
+        sock.setblocking(False)
+        clients.append([sock, bytearray(), None])
+        host.poll() # accept as we go so the backlog never fills
+    moves = [game.left, game.right, game.rotate_left, game.down]
+    delta = datetime.timedelta(seconds=1/30)
+    cpu = 0.0
+    for frame in range(frames):
+        if not game.step(delta):
+            break
+        random.choice(moves)()
+        start = time.process_time()
+        host.poll()
+        cpu += time.process_time() - start
+        for client in clients:
+            receive(client)
+    for i in range(10): # let everything drain
+        start = time.process_time()
+        host.poll(0.01)
+        cpu += time.process_time() - start
+        for client in clients:
+            receive(client)
+    synced = sum(1 for c in clients if c[2] == host.cells)
+    result = {
+        "spectators": spectators,
+        "frames": frame + 1,
+        "connected": len(host.channels),
+        "synced": synced,
+        "bytes_encoded": host.bytes_encoded,
+        "bytes_per_spectator": host.bytes_sent / max(spectators, 1),
+        "cpu": cpu,
+        "cpu_per_spectator": cpu / max(spectators, 1),
+    }
+    for client in clients:
+        client[0].close()
+    host.close()
+    return result
+
+def receive(client):
+    """
+    Reads and decodes everything available to a loopback watcher
+    """
+    sock, buf, cells = client
+    while True:
+        try:
+            data = sock.recv(65536)
+        except BlockingIOError:
+            break
+        if not data:
+            break
+        buf += data
+    while len(buf) >= HEADER.size:
+        kind, size = HEADER.unpack_from(buf)
+        if len(buf) < HEADER.size + size:
+            break
+        payload = bytes(buf[HEADER.size:HEADER.size + size])
+        del buf[:HEADER.size + size]
+        if kind == KEYFRAME:
+            cells = decode_keyframe(payload)[2]
+        else:
+            decode_delta(payload, cells)
+    client[2] = cells
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description=\
+        "Measure the cost of streaming a game to loopback spectators")
+    parser.add_argument("spectators", type=int, nargs="*",\
+                        default=[1, 100, 300])
+    parser.add_argument("--frames", type=int, default=600)
+    args = parser.parse_args()
+    base = None
+    for n in args.spectators:
+        r = measure(n, args.frames)
+        line = "%4i spectators: %i/%i synced, %i bytes encoded, "\
+               "%.0f bytes/spectator, %.2f ms cpu, %.3f ms cpu/spectator"\
+               % (n, r["synced"], n, r["bytes_encoded"],\
+                  r["bytes_per_spectator"], r["cpu"] * 1000,\
+                  r["cpu_per_spectator"] * 1000)
+        if base is not None and n > base["spectators"]:
+            added = (r["cpu"] - base["cpu"]) / (n - base["spectators"])
+            line += ", %.3f ms cpu per added spectator" % (added * 1000)
+        print(line)
+        base = r
@@ -3,12 +3,9 @@ Game state manager for tetris
 """
 
 import curses
-import time, datetime, math, os, threading
-import xml.etree.ElementTree as ET
 from abc import ABCMeta, abstractmethod
 
 from events import *
-from game import *
 
 class StateManager(object):
     """
@@ -69,17 +66,19 @@ class StateManager(object):
         Returns the shared data for this manager
         """
         return self.__data
-    def input(self, char):
+    def input(self, char, count=1):
         """
         Sends the passed character into the active state as input
+        
+        count: Number of times the character was received in a row
         """
         if self.active_state is not None:
-            self.active_state.input(char)
+            self.active_state.input(char, count)
     def render(self, window, delta, terminal_size=None):
         """
         Renders the current state onto the passed window
         
-        window: Curses window to render to
+        window: Backend to render to
         delta: Seconds that have passed since the last render
         """
         if self.active_state is not None:
@@ -99,9 +98,10 @@ class State(metaclass=ABCMeta):
     def exit(self):
         pass
     @abstractmethod
-    def input(self, char):
+    def input(self, char, count=1):
         """
-        Process the passed character as input
+        Process the passed character as input. count is the number of
+        times the character was received in a row since the last frame.
         """
         pass
     @abstractmethod
@@ -124,56 +124,40 @@ class StateInitializationException(Exception):
         
 class LoadState(State):
     """
-    State which loads the initial resources for the game
+    State which waits for the initial resources for the game
+
+    The resources are loaded in the background by start_loading so that
+    the main menu can be shown straight away. This state is only entered
+    if something needs them before they are ready, and it replaces itself
+    with the next state once they are.
     """
-    def __load(self):
-        # attempt to load the data
-        colordefs = {}
-        block_types = {}
-        tree = ET.parse('data.xml')
-        root = tree.getroot()
-        if root is not None:
-            for color in root.findall('color'):
-                colordefs[color.get('id')] = \
-                    (get_curses_color(color.get('fg')), \
-                     get_curses_color(color.get('bg')))
-            for t in root.findall('type'):
-                polyominoes = []
-                for p in t.findall('polyomino'):
-                    blocktuples = []
-                    for b in p.findall('block'):
-                        blocktuples.append((int(b.get('x')), \
-                                            int(b.get('y'))))
-                    polyominoes.append(PolyominoFactory(blocktuples,\
-                                       int(p.get('color'))))
-                block_types[t.get('name')] = polyominoes
-        self.manager.data["block_types"] = block_types
-        # set up the color definitions
-        for i in colordefs:
-            color = colordefs[i]
-            curses.init_pair(int(i), color[0], color[1])
+    def __init__(self, next_state):
+        self.next_state = next_state
     def init(self, manager):
         self.manager = manager
-        self.loading_thread = threading.Thread(target=self.__load)
-        self.loading_thread.start()
+        self.loading_thread = start_loading(manager)
     def enter(self):
         pass
     def exit(self):
         pass
-    def input(self, char):
+    def input(self, char, count=1):
         if char == 27: # end this state
-            self.loading_thread.join()
             self.manager.pop_state()
     def render(self, window, delta, terminal_size=None):
-        if not self.loading_thread.is_alive(): # become the main menu
-            self.manager.replace_state(MainMenuState())
+        if not self.loading_thread.is_alive(): # become the next state
+            if "block_types" not in self.manager.data:
+                raise StateInitializationException("Loading data failed")
+            # colors are set up here since the backend belongs to the
+            # rendering thread
+            window.init_colors(self.manager.data["colors"])
+            self.manager.replace_state(self.next_state)
             return
         window.clear()
         window.border()
         if terminal_size is None:
-            window.addstr(1, 1, "Loading...%s" % str(delta))
+            window.text(1, 1, "Loading...%s" % str(delta))
         else:
-            window.addstr(int(terminal_size.lines / 2),\
+            window.text(int(terminal_size.lines / 2),\
                           int(terminal_size.columns / 2) - 5,\
                           "Loading...")
 
@@ -190,11 +174,12 @@ class MainMenuState(State):
         self.changed = False
         self.last_size = None
         self.selected = 0 # selected menu index
+        start_loading(manager) # we'll probably need the data soon
     def enter(self): 
         self.changed = True # when we enter, we change
     def exit(self):
         pass
-    def input(self, char):
+    def input(self, char, count=1):
         if char == 27:
             self.manager.pop_state()
         elif char == curses.KEY_UP and self.selected > 0:
@@ -206,8 +191,9 @@ class MainMenuState(State):
             self.changed = True
         elif char == 10:
             if self.selected == MainMenuState.NEW_GAME_INDEX:
-                self.manager.push_state(NewGameMenuState())
+                self.manager.push_state(LoadState(NewGameMenuState()))
             elif self.selected == MainMenuState.HIGH_SCORES_INDEX:
+                from play import HighScoresState
                 self.manager.push_state(HighScoresState())
             elif self.selected == MainMenuState.QUIT_INDEX:
                 self.manager.pop_state()
@@ -220,15 +206,14 @@ class MainMenuState(State):
         title = "Tetris"
         dash = "---"
         menu = "Main Menu"
-        window.addstr(1, self.__get_column(terminal_size, title), title)
-        window.addstr(3, self.__get_column(terminal_size, dash), dash)
-        window.addstr(4, self.__get_column(terminal_size, menu), menu)
+        window.text(1, self.__get_column(terminal_size, title), title)
+        window.text(3, self.__get_column(terminal_size, dash), dash)
+        window.text(4, self.__get_column(terminal_size, menu), menu)
         for i in range(len(MainMenuState.MENU)):
             phrase = MainMenuState.MENU[i]
-            attr = curses.A_STANDOUT if i == self.selected else 0
-            window.addstr(6 + i, \
-                          self.__get_column(terminal_size, phrase),\
-                          phrase, attr)
+            window.text(6 + i, \
+                        self.__get_column(terminal_size, phrase),\
+                        phrase, i == self.selected)
         self.changed = False
     def __get_column(self, terminal_size, phrase):
         if terminal_size == None:
@@ -257,7 +242,7 @@ class NewGameMenuState(State):
         self.changed = True
     def exit(self):
         pass
-    def input(self, char):
+    def input(self, char, count=1):
         if char == curses.KEY_UP and self.selected > 0:
             self.selected -= 1
             self.changed = True
@@ -268,6 +253,7 @@ class NewGameMenuState(State):
         elif char == 10:
             # create a new game
             blocks = self.manager.data["block_types"][self.block_types[self.selected]]
+            from play import GameState
             self.manager.replace_state(GameState(blocks))
     def render(self, window, delta, terminal_size=None):
         if not self.changed and self.last_size == terminal_size:
@@ -275,13 +261,12 @@ class NewGameMenuState(State):
         window.clear()
         window.border()
         title = "Select a game type:"
-        window.addstr(2, self.__get_column(terminal_size, title), title)
+        window.text(2, self.__get_column(terminal_size, title), title)
         for i in range(len(self.block_types)):
             phrase = self.block_types[i]
-            attr = curses.A_STANDOUT if i == self.selected else 0
-            window.addstr(4 + i, \
-                          self.__get_column(terminal_size, phrase),\
-                          phrase, attr)
+            window.text(4 + i, \
+                        self.__get_column(terminal_size, phrase),\
+                        phrase, i == self.selected)
         self.changed = False
     def __get_column(self, terminal_size, phrase):
         if terminal_size == None:
@@ -289,157 +274,20 @@ class NewGameMenuState(State):
         else:
             return int(terminal_size.columns / 2) - int(len(phrase) / 2)
     
-class HighScoresState(State):
-    """
-    State for viewing the high scores
-    """
-    def init(self, manager):
-        self.manager = manager
-    def enter(self):
-        pass
-    def exit(self):
-        pass
-    def input(self, char):
-        pass
-    def render(self, window, delta, terminal_size=None):
-        self.manager.pop_state()
-    
-class GameState(State):
-    """
-    State for playing a game
+def start_loading(manager):
     """
-    def __init__(self, blocks):
-        self.last_size = None
-        self.game = MasterTetris((35, 1), blocks)
-        self.game.event += self.__on_game_event
-        self.to_erase = {}
-        self.to_draw = {}
-        self.redraw = False
-    def __on_game_event(self, e):
-        if e.name == 'position-changed' and hasattr(e.target, 'render'):
-            if e.kwargs['last'][1] < 1 or e.kwargs['current'][1] < 1:
-                return
-            if id(e.target) not in self.to_erase:
-                self.to_erase[id(e.target)] = e.kwargs['last']
-            self.to_draw[id(e.target)] = e.kwargs['current'] +\
-                                         (e.target.render[0],)
-        if e.name == "block-removed":
-            # we need to erase at this block's position
-            if id(e.kwargs['block']) not in self.to_erase:
-                self.to_erase[id(e.kwargs['block'])] =\
-                    e.kwargs['block'].position
-    def init(self, manager):
-        self.manager = manager
-    def enter(self):
-        self.redraw = True
-        self.to_erase.clear()
-        self.to_draw.clear()
-    def exit(self):
-        pass
-    def input(self, char):
-        if char == 27:
-            self.manager.pop_state()
-        elif char == curses.KEY_UP:
-            self.game.rotate_left()
-        elif char == curses.KEY_LEFT:
-            self.game.left()
-        elif char == curses.KEY_RIGHT:
-            self.game.right()
-        elif char == curses.KEY_DOWN:
-            self.game.down()
-        elif char == 32:
-            self.manager.push_state(PausedState())
-    def render(self, window, delta, terminal_size=None):
-        if not self.game.step(delta):
-            self.manager.pop_state()
-            return
-        if self.redraw:
-            window.clear()
-            window.border()
-            window.hline(21, 34, ord('-'), 12)
-            window.vline(1, 34, ord('|'), 20)
-            window.vline(1, 45, ord('|'), 20)
-            if self.game.current_piece is not None:
-                for b in self.game.current_piece.blocks:
-                    window.addch(b.position[1], b.position[0],\
-                                 ord('#'),\
-                                 curses.color_pair(b.color))
-            for x in range(self.game.grid.width):
-                for y in range(self.game.grid.height):
-                    b = self.game.grid.grid[x][y]
-                    if b is not None:
-                        window.addch(b.position[1], b.position[0],\
-                                     ord('#'),\
-                                     curses.color_pair(b.render[0]))
-            self.to_erase.clear()
-            self.to_draw.clear()
-            self.redraw = False
-        else:
-            if len(self.to_erase) == 0 or len(self.to_draw) == 0:
-                return
-            for v in self.to_erase:
-                pos = self.to_erase[v]
-                window.addch(pos[1], pos[0],\
-                             ord(' '))
-            for v in self.to_draw:
-                pos = self.to_draw[v]
-                window.addch(pos[1], pos[0],\
-                             ord('#'), curses.color_pair(pos[2]))
-            self.to_erase.clear()
-            self.to_draw.clear()
-        window.addstr(10, 50, "Score: %i      " % self.game.score)
-        window.addstr(11, 50, "Lines: %i      " % self.game.lines)
-        window.addstr(12, 50, "Level: %i      " % self.game.level)
-        
-class PausedState(State):
-    """
-    State during which the game is paused. This only overwrites a
-    small portion of the screen
+    Starts loading the game data into the manager's shared data on a
+    background thread, unless that has already been started
+
+    Returns the loading thread
     """
-    def init(self, manager):
-        self.manager = manager
-        self.changed = False
-    def enter(self):
-        self.changed = True
-    def exit(self):
-        pass
-    def input(self, char):
-        self.manager.pop_state() # any input makes us leave
-    def render(self, window, delta, terminal_size=None):
-        if not self.changed:
-            return
-        t = "Paused"
-        p = "Press any key to unpause"
-        rb = 0 #row base
-        if terminal_size is not None:
-            rb = int(math.ceil(terminal_size.lines / 2)) - 1
-        window.addstr(rb, self.__get_column(terminal_size, t), t,\
-            curses.A_STANDOUT)
-        window.addstr(rb + 1, self.__get_column(terminal_size, p), p,\
-            curses.A_STANDOUT)
-        self.changed = False
-    def __get_column(self, terminal_size, phrase):
-        if terminal_size == None:
-            return 0
-        else:
-            return int(terminal_size.columns / 2) - int(len(phrase) / 2)
-        
-def get_curses_color(name):
-    if name == "black":
-        return curses.COLOR_BLACK
-    elif name == "blue":
-        return curses.COLOR_BLUE
-    elif name == "cyan":
-        return curses.COLOR_CYAN
-    elif name == "green":
-        return curses.COLOR_GREEN
-    elif name == "magenta":
-        return curses.COLOR_MAGENTA
-    elif name == "red":
-        return curses.COLOR_RED
-    elif name == "white":
-        return curses.COLOR_WHITE
-    elif name == "yellow":
-        return curses.COLOR_YELLOW
-    else:
-        return None
+    if "loader" not in manager.data:
+        import threading
+        def load():
+            from game import load_data
+            colordefs, block_types = load_data()
+            manager.data["block_types"] = block_types
+            manager.data["colors"] = colordefs
+        manager.data["loader"] = threading.Thread(target=load, daemon=True)
+        manager.data["loader"].start()
+    return manager.data["loader"]
@@ -0,0 +1,36 @@
+"""
+Tests for the boardpool module
+"""
+
+import unittest
+from boardpool import *
+from game import Grid, PolyominoFactory
+
+BOX = PolyominoFactory([(-1, 0), (-1, 1), (0, 0), (0, 1)], 5, "box")
+
+class BoardPoolTest(unittest.TestCase):
+    def setUp(self):
+        self.pool = BoardPool(2)
+    def tearDown(self):
+        self.pool.close()
+        self.pool.unlink()
+    def test_read_gives_up_on_abandoned_write(self):
+        # a writer that died between making the counter odd and even
+        SEQUENCE.pack_into(self.pool.buffer, self.pool.slot_size, 1)
+        with self.assertRaises(BoardBusyException):
+            self.pool.read(1, 100)
+        self.assertEqual(self.pool.read(0), (bytes(self.pool.cells), 0))
+    def test_new_grid_clears_reused_slot(self):
+        slot = self.pool.slot(0)
+        grid = Grid(board=slot)
+        grid.add_polyomino(BOX(grid, (5, 18)))
+        self.assertNotEqual(self.pool.read(0)[0], bytes(self.pool.cells))
+        Grid(board=slot)
+        self.assertEqual(self.pool.read(0)[0], bytes(self.pool.cells))
+    def test_grid_must_match_slot_size(self):
+        with self.assertRaisesRegex(ValueError, "10x20"):
+            Grid(width=8, board=self.pool.slot(0))
+        self.assertEqual(self.pool.sequence(0), 0)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,43 @@
+"""
+Tests for the controls module
+"""
+
+import datetime, unittest
+from controls import *
+
+KEY = 1
+
+def ms(n):
+    return datetime.timedelta(milliseconds=n)
+
+class KeyRepeatTest(unittest.TestCase):
+    def setUp(self):
+        self.repeat = KeyRepeat([KEY], das=ms(170), arr=ms(50))
+    def hold(self, start, end, step=33):
+        """
+        Feeds terminal repeats every step ms, returning the moves
+        """
+        return sum(self.repeat(KEY, 1, ms(t))\
+                   for t in range(start, end, step))
+    def test_quick_second_tap_moves(self):
+        self.assertEqual(self.repeat(KEY, 1, ms(0)), 1)
+        self.assertEqual(self.repeat(KEY, 1, ms(66)), 1)
+    def test_other_keys_pass_through(self):
+        self.assertEqual(self.repeat(2, 4, ms(0)), 4)
+    def test_held_key_waits_for_das(self):
+        self.assertEqual(self.repeat(KEY, 1, ms(0)), 1)
+        self.assertEqual(self.hold(33, 170), 0)
+        self.assertGreater(self.hold(170, 400), 0)
+    def test_terminal_delay_counts_towards_das(self):
+        self.assertEqual(self.repeat(KEY, 1, ms(0)), 1)
+        # the terminal's first repeat after its own delay
+        self.assertEqual(self.repeat(KEY, 1, ms(500)), 1)
+        # DAS has already passed, so repeats move at the ARR
+        self.assertEqual(self.hold(533, 1033), 10)
+    def test_zero_arr_is_instant(self):
+        repeat = KeyRepeat([KEY], das=ms(0), arr=ms(0))
+        repeat(KEY, 1, ms(0))
+        self.assertEqual(repeat(KEY, 1, ms(33)), KeyRepeat.INSTANT)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,62 @@
+"""
+Tests for the game module
+"""
+
+import unittest
+from game import *
+
+BOX = PolyominoFactory([(-1, 0), (-1, 1), (0, 0), (0, 1)], 5, "box")
+
+class GarbageTest(unittest.TestCase):
+    def setUp(self):
+        self.game = MasterTetris((0, 0), [BOX], 0)
+        while self.game.current_piece is None:
+            self.game.tick()
+        self.grid = self.game.grid
+        # rest the box on the floor so garbage overlaps it
+        self.game.down(self.grid.height)
+    def piece_positions(self):
+        return [b.position for b in self.game.current_piece.blocks]
+    def test_piece_pushed_above_top_stays_in_bounds(self):
+        self.assertTrue(self.game.add_garbage(self.grid.height, 0))
+        self.assertEqual(min(p[1] for p in self.piece_positions()), -2)
+        self.game.right(20)
+        self.assertLess(max(p[0] for p in self.piece_positions()),\
+                        self.grid.width)
+        self.game.left(20)
+        self.assertGreaterEqual(min(p[0] for p in self.piece_positions()),\
+                                0)
+    def test_piece_locked_above_top_tops_out(self):
+        self.assertTrue(self.game.add_garbage(self.grid.height - 1, 0))
+        self.assertEqual(min(p[1] for p in self.piece_positions()), -1)
+        before = self.grid.save_cells()
+        over = False
+        for i in range(MasterTetris.FPS * 2):
+            if not self.game.tick():
+                over = True
+                break
+        self.assertTrue(over)
+        self.assertEqual(self.grid.save_cells(), before)
+        for y in range(self.grid.height):
+            self.assertLess(self.grid.row(y).count, self.grid.width)
+    def test_garbage_needs_a_hole_in_the_grid(self):
+        for hole in (-1, self.grid.width):
+            with self.assertRaises(ValueError):
+                self.grid.insert_garbage(1, hole)
+        with self.assertRaises(ValueError):
+            self.game.add_garbage(-1, 0)
+        self.assertEqual(self.grid.clear_rows(), [])
+    def test_add_polyomino_rejects_rows_above_top(self):
+        piece = BOX(self.grid, (5, -1))
+        self.assertFalse(self.grid.add_polyomino(piece))
+        for y in range(self.grid.height):
+            self.assertEqual(self.grid.row(y).count, 0)
+    def test_add_polyomino_on_offset_grid(self):
+        grid = Grid((3, 2), 6, 8)
+        piece = BOX(grid, (1, 6))
+        self.assertTrue(grid.add_polyomino(piece))
+        self.assertEqual(grid.row(7).count, 2)
+        self.assertEqual(grid.block_at((0, 7)).position, (3, 9))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,114 @@
+"""
+Tests for the replay module
+"""
+
+import os, shutil, tempfile, unittest
+from replay import *
+
+GAMES = [
+    (1, "Tetrominoes", [(0, 260), (3, 261), (7, 259)], 120, 4, 1),
+    (2, "Pentominoes", [], 0, 0, 1),
+    (3, "Tetrominoes", [(i, 258) for i in range(100)], 950, 12, 2),
+]
+
+class CorpusTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "corpus")
+        with ReplayWriter(self.path) as writer:
+            for n in range(len(GAMES)):
+                seed, piece_set, inputs, score, lines, level = GAMES[n]
+                self.assertEqual(writer.append(seed, piece_set, inputs,\
+                                               score, lines, level), n)
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+    def test_round_trip(self):
+        with ReplayCorpus(self.path) as corpus:
+            self.assertEqual(len(corpus), len(GAMES))
+            for n in range(len(GAMES)):
+                record = corpus[n]
+                seed, piece_set, inputs, score, lines, level = GAMES[n]
+                self.assertEqual(record.header, (seed, piece_set, score,\
+                                 lines, level, len(inputs)))
+                self.assertEqual(list(record.inputs), inputs)
+            self.assertEqual(corpus[-1].seed, GAMES[-1][0])
+            with self.assertRaises(IndexError):
+                corpus[len(GAMES)]
+    def test_iterate_in_file_order(self):
+        with ReplayCorpus(self.path) as corpus:
+            self.assertEqual([r.seed for r in corpus],\
+                             [g[0] for g in GAMES])
+            self.assertEqual(list(corpus.results()),\
+                             [(g[3], g[4], g[5]) for g in GAMES])
+    def test_histogram(self):
+        with ReplayCorpus(self.path) as corpus:
+            self.assertEqual(corpus.histogram(100), {0: 1, 100: 1, 900: 1})
+            self.assertEqual(corpus.histogram(10, 1), {0: 2, 10: 1})
+    def test_game_past_end_of_data(self):
+        # an index entry for a game whose data hasn't been mapped yet
+        with open(self.path, 'rb') as f:
+            data = f.read()
+        with open(self.path, 'wb') as f:
+            f.write(data[:-10])
+        with ReplayCorpus(self.path) as corpus:
+            with self.assertRaises(ReplayFormatException):
+                corpus[2]
+            self.assertEqual([r.seed for r in corpus],\
+                             [g[0] for g in GAMES[:2]])
+            self.assertEqual(len(list(corpus.results())), 2)
+    def test_close_with_half_used_iterator(self):
+        with ReplayCorpus(self.path) as corpus:
+            inputs = corpus[2].inputs
+            self.assertEqual(next(inputs), (0, 258))
+            records = iter(corpus)
+            next(records)
+    def test_close_with_live_raw_inputs(self):
+        with ReplayCorpus(self.path) as corpus:
+            raw = corpus[0].raw_inputs
+        self.assertEqual(len(raw), INPUT.size * len(GAMES[0][2]))
+        raw.release()
+class ReplayTest(unittest.TestCase):
+    def setUp(self):
+        from game import load_data
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "corpus")
+        self.block_types = load_data()[1]
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+    def check(self, frames):
+        with ReplayWriter(self.path) as writer:
+            simulate(writer, 3, frames=frames)
+        with ReplayCorpus(self.path) as corpus:
+            for record in corpus:
+                game = replay(record, self.block_types[record.piece_set])
+                self.assertEqual((game.score, game.lines, game.level),\
+                                 (record.score, record.lines, record.level))
+    def test_replay_gives_same_board(self):
+        import random
+        from game import MasterTetris
+        blocks = self.block_types["Tetrominoes"]
+        chooser = random.Random(4)
+        game = MasterTetris((0, 0), blocks, 7)
+        actions = key_actions(game)
+        keys = sorted(actions.keys())
+        inputs = []
+        for frame in range(1500):
+            for i in range(chooser.randrange(3)):
+                key = chooser.choice(keys)
+                actions[key]()
+                inputs.append((frame, key))
+            self.assertTrue(game.tick())
+        inputs.append((1500, STOP))
+        with ReplayWriter(self.path) as writer:
+            writer.append(7, "Tetrominoes", inputs, game.score,\
+                          game.lines, game.level)
+        with ReplayCorpus(self.path) as corpus:
+            played = replay(corpus[0], blocks)
+        self.assertEqual(played.save_state(), game.save_state())
+    def test_replay_finished_games(self):
+        self.check(100000)
+    def test_replay_stopped_games(self):
+        self.check(200)
+
+if __name__ == "__main__":
+    unittest.main()
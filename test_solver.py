@@ -0,0 +1,31 @@
+"""
+Tests for the solver module
+"""
+
+import unittest
+from game import PolyominoFactory
+from solver import *
+
+LINE = PolyominoFactory([(-1, 0), (0, 0), (1, 0), (2, 0)], 1, "line")
+BOX = PolyominoFactory([(-1, 0), (-1, 1), (0, 0), (0, 1)], 5, "box")
+
+class SolverTest(unittest.TestCase):
+    def setUp(self):
+        self.solver = Solver([LINE, BOX], 10, 20)
+        self.empty = [0] * 20
+    def test_placements_follow_sequence(self):
+        self.solver.solve(self.empty, ['line'] * 3)
+        solution = self.solver.solve(self.empty, ['box'] * 5, max_depth=3)
+        self.assertEqual([p.shape.name for p in solution.placements],\
+                         ['box'] * 3)
+    def test_perfect_clear_after_failed_search(self):
+        failed = self.solver.solve(self.empty, ['line'] * 5, perfect=True)
+        self.assertEqual(failed.placements, [])
+        solution = self.solver.solve(self.empty, ['box'] * 5, perfect=True)
+        fresh = Solver([LINE, BOX], 10, 20).solve(self.empty, ['box'] * 5,\
+                                                  perfect=True)
+        self.assertEqual(len(solution.placements), 5)
+        self.assertEqual(len(solution.placements), len(fresh.placements))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,31 @@
+"""
+Tests for the spectate module
+"""
+
+import socket, unittest
+from spectate import *
+
+class ChannelTest(unittest.TestCase):
+    def test_pending_counts_bytes_sent_before_socket_fills(self):
+        a, b = socket.socketpair()
+        a.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 4096)
+        a.setblocking(False)
+        b.setblocking(False)
+        channel = SpectatorChannel(a)
+        for i in range(1000):
+            channel.push(b'x' * 2000)
+        sent = channel.send()
+        received = 0
+        try:
+            while True:
+                received += len(b.recv(1 << 20))
+        except BlockingIOError:
+            pass
+        a.close()
+        b.close()
+        self.assertGreater(sent, 0)
+        self.assertEqual(received, sent)
+        self.assertEqual(channel.pending, 1000 * 2000 - sent)
+
+if __name__ == "__main__":
+    unittest.main()